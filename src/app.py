@@ -1,30 +1,266 @@
-from flask import Flask, render_template, request, jsonify
-from backend.chatbot import Chatbot
+from flask import Flask, Response, render_template, request, jsonify, session
+from backend.async_chatbot import AsyncChatbot, BackgroundLoop
+from backend.cache import cached_phases, shared_cache
+from backend.cassette import shared_cassette
+from backend.context import shared_context_window
+from backend.convergence import shared_convergence
+from backend.fastpath import shared_router
+from backend.ledger import shared_ledger
+from backend.metrics import shared_metrics
+from backend.model_router import shared_model_router
+from backend.plan_index import shared_plan_index
+from backend.prompt_layout import shared_prompt_cache
+from backend.ratelimit import shared_rate_limiter
+from backend.scheduler import Busy, Scheduler
+from backend.sessions import SessionManager
+from backend.transport import shared_transport
+from backend.upstream import shared_upstream
 from flask_socketio import SocketIO, emit
+from dotenv import load_dotenv
+from uuid import uuid4
+import os
+
+load_dotenv("env/.env")
 
 app = Flask(__name__, template_folder="frontend/templates", static_folder="frontend/static")
+app.secret_key = os.getenv("SECRET_KEY") or os.urandom(24)
 socketio = SocketIO(app)
-chatbot = Chatbot()
+
+# Chat turns run as coroutines on one event loop, so handlers never block on upstream calls
+loop = BackgroundLoop()
+
+# One chatbot per client, bounded by count and idle time
+sessions = SessionManager(
+    factory=AsyncChatbot,
+    max_sessions=int(os.getenv("MAX_SESSIONS", 256)),
+    idle_ttl=float(os.getenv("SESSION_IDLE_TTL", 1800)),
+)
+# Admission control and fair dispatch of chat turns: standard replies first, clients take turns
+scheduler = Scheduler(
+    workers=int(os.getenv("SCHEDULER_WORKERS", 32)),
+    max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", 256)),
+    client_queue=int(os.getenv("SCHEDULER_CLIENT_QUEUE", 4)),
+    client_running=int(os.getenv("SCHEDULER_CLIENT_RUNNING", 2)),
+    standard_burst=int(os.getenv("SCHEDULER_STANDARD_BURST", 4)),
+    max_wait=float(os.getenv("SCHEDULER_MAX_WAIT", 120)),
+)
+metrics = shared_metrics()
+metrics.gauge("preasoner_active_sessions", "Chatbot sessions held in memory", lambda: len(sessions))
+metrics.gauge("preasoner_busy_sessions", "Sessions with a turn in progress", sessions.busy_count)
+# "sid" gives every Socket.IO connection its own chatbot, "cookie" keeps it across reconnects
+session_key_mode = os.getenv("SESSION_KEY", "sid")
+# Stream standard-mode replies token by token instead of sending them whole
+stream_replies = os.getenv("STREAM_REPLIES", "1") == "1"
+
+def session_key():
+    """Key identifying the current client's chatbot session"""
+    if session_key_mode == "cookie" and "chat_id" in session:
+        return session["chat_id"]
+    return request.sid
 
 @app.route('/')
 def home():
+    session.setdefault("chat_id", uuid4().hex)
     return render_template('index.html')
 
+@app.route('/sessions')
+def session_stats():
+    sessions.evict_idle()
+    return jsonify(sessions.stats())
+
+@app.route('/fastpath')
+def fast_path_stats():
+    router = shared_router()
+    return jsonify(router.report() if router else {'enabled': False})
+
+@app.route('/cache')
+def cache_stats():
+    if not cached_phases():
+        return jsonify({'enabled': False})
+    return jsonify({'phases': sorted(cached_phases()), **shared_cache().report()})
+
+@app.route('/plans')
+def plan_index_stats():
+    index = shared_plan_index()
+    return jsonify(index.report() if index else {'enabled': False})
+
+@app.route('/context')
+def context_stats():
+    window = shared_context_window()
+    return jsonify(window.report() if window else {'enabled': False})
+
+@app.route('/prompt-cache')
+def prompt_cache_stats():
+    return jsonify(shared_prompt_cache().report())
+
+@app.route('/convergence')
+def convergence_stats():
+    detector = shared_convergence()
+    return jsonify(detector.report() if detector else {'enabled': False})
+
+@app.route('/models')
+def model_router_stats():
+    router = shared_model_router()
+    return jsonify(router.report() if router else {'enabled': False})
+
+@app.route('/upstream')
+def upstream_stats():
+    return jsonify(shared_upstream().report())
+
+@app.route('/ratelimit')
+def rate_limit_stats():
+    return jsonify(shared_rate_limiter().report())
+
+@app.route('/transport')
+def transport_stats():
+    return jsonify(shared_transport().report())
+
+@app.route('/cassette')
+def cassette_stats():
+    cassette = shared_cassette()
+    return jsonify(cassette.report() if cassette else {'enabled': False})
+
+@app.route('/ledger')
+def ledger_stats():
+    session_id = request.args.get('session')
+    if session_id is None:
+        return jsonify(shared_ledger().report())
+    report = shared_ledger().session_report(session_id)
+    if report is None:
+        return jsonify({'error': 'unknown session'}), 404
+    return jsonify(report)
+
+@app.route('/scheduler')
+def scheduler_stats():
+    return jsonify(scheduler.report())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+async def stream_turn(chatbot, sid, user_message, refining=False):
+    tokens = []
+    async for token in chatbot.get_response_stream(user_message):
+        tokens.append(token)
+        socketio.emit('receive_token', {'token': token}, to=sid)
+    socketio.emit('receive_message_done', {
+        'message': ''.join(tokens),
+        'sender': 'bot',
+        'ttft_ms': None if chatbot.last_ttft is None else round(chatbot.last_ttft * 1000),
+        'refining': refining
+    }, to=sid)
+    return ''.join(tokens)
+
+async def refine_turn(key, sid, reasoner, user_message, draft):
+    refined, revised = draft, False
+    try:
+        refined = await reasoner.multi_agent_response(user_message)
+        async with sessions.use_async(key) as chatbot:
+            # A direct answer only resampled the draft, and a run cut short before refining has no better answer
+            if reasoner.run_completed():
+                revised = chatbot.revise_reply(draft, refined)
+            chatbot.last_run = reasoner.last_run
+    finally:
+        # Always settle the client's pending draft, even when refinement failed
+        socketio.emit('receive_revision', {
+            'message': refined if revised else draft,
+            'revised': revised,
+            'sender': 'bot'
+        }, to=sid)
+
+async def answer_first_turn(key, sid, chatbot, user_message):
+    # Without reasoning to add, the draft is the answer and nothing is forked
+    if not chatbot.would_reason(user_message):
+        return await stream_turn(chatbot, sid, user_message)
+    # The reasoner works on a copy of the history taken before the draft is added
+    reasoner = chatbot.fork()
+    draft = await stream_turn(chatbot, sid, user_message, refining=True)
+    # Refinement waits in the reasoning lane; without room for it the draft simply stands
+    def settle(reason):
+        socketio.emit('receive_revision', {'message': draft, 'revised': False, 'sender': 'bot'}, to=sid)
+    try:
+        scheduler.submit(key, "reasoning", lambda: refine_turn(key, sid, reasoner, user_message, draft), on_shed=settle)
+    except Busy as e:
+        settle(e.reason)
+
+def progress_forwarder(sid):
+    """Forward a chatbot's reasoning progress events to one client"""
+    def forward(event, data):
+        socketio.emit('reasoning_progress', {'event': event, **data}, to=sid)
+    return forward
+
+async def run_turn(key, sid, user_message):
+    async with sessions.use_async(key) as chatbot:
+        if chatbot.reasoning_enabled and chatbot.answer_first_enabled:
+            return await answer_first_turn(key, sid, chatbot, user_message)
+        if stream_replies and not chatbot.reasoning_enabled:
+            return await stream_turn(chatbot, sid, user_message)
+        chatbot.on_progress = progress_forwarder(sid)
+        try:
+            response = await chatbot.process_input(user_message)
+        finally:
+            chatbot.on_progress = None
+    socketio.emit('receive_message', {
+        'message': response,
+        'sender': 'bot'
+    }, to=sid)
+
+def busy(sid, reason):
+    """Tell a client its turn was shed because the server is over capacity"""
+    socketio.emit('busy', {
+        'reason': reason,
+        'message': 'The server is busy, please try again in a moment.'
+    }, to=sid)
+
+def turn_failed(sid, error):
+    """Tell a client its turn failed, so it gets its input back instead of waiting forever"""
+    socketio.emit('turn_error', {
+        'message': f'An error occurred: {str(error)}',
+        'sender': 'bot'
+    }, to=sid)
+
+async def admit_turn(key, sid, user_message):
+    # Standard replies (answer-first drafts included) go ahead of full reasoning runs
+    chatbot = sessions.get(key).chatbot
+    lane = "reasoning" if chatbot.reasoning_enabled and not chatbot.answer_first_enabled else "standard"
+
+    async def run():
+        socketio.emit('queue_position', {'position': 0}, to=sid)
+        await run_turn(key, sid, user_message)
+
+    try:
+        scheduler.submit(
+            key, lane, run,
+            on_position=lambda position: socketio.emit('queue_position', {'position': position, 'lane': lane}, to=sid),
+            on_shed=lambda reason: busy(sid, reason),
+            on_error=lambda error: turn_failed(sid, error),
+        )
+    except Busy as e:
+        busy(sid, e.reason)
+
 @socketio.on('send_message')
 def handle_message(data):
     user_message = data['message']
-    response = chatbot.process_input(user_message)
-    emit('receive_message', {
-        'message': response,
-        'sender': 'bot'
-    })
+    loop.submit(admit_turn(session_key(), request.sid, user_message))
 
 @socketio.on('toggle_reasoning')
 def handle_toggle():
-    is_enabled = chatbot.toggle_reasoning()
+    is_enabled = sessions.get(session_key()).chatbot.toggle_reasoning()
     emit('reasoning_toggled', {
         'enabled': is_enabled
     })
 
+@socketio.on('toggle_answer_first')
+def handle_answer_first_toggle():
+    is_enabled = sessions.get(session_key()).chatbot.toggle_answer_first()
+    emit('answer_first_toggled', {
+        'enabled': is_enabled
+    })
+
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    if session_key_mode != "cookie":
+        sessions.drop(request.sid)
+
 if __name__ == '__main__':
     socketio.run(app, debug=True)
@@ -0,0 +1,249 @@
+# async_chatbot.py
+import asyncio
+import threading
+import time
+import traceback
+
+from backend.chatbot import Chatbot
+from backend.plan import StepGraph
+from backend.transport import async_openai_client
+
+
+class AsyncChatbot(Chatbot):
+    """Chatbot whose whole pipeline runs on asyncio, so one process can hold many reasoning sessions in flight
+
+    Everything but the upstream calls is shared with Chatbot; the methods here
+    only differ from their synchronous versions where they await.
+    """
+
+    asynchronous = True
+
+    def _make_client(self):
+        """Create the asynchronous OpenRouter client, sharing the process-wide connection pool"""
+        return async_openai_client()
+
+    async def _complete(self, phase, model, messages, **params):
+        """Send one upstream request for the given phase, parsing it when a response_format is given"""
+        with self.metrics.span(phase, model) as span:
+            key, local = self._local_reply(span, phase, model, messages, params)
+            if local is not None:
+                return local
+
+            requested, messages = messages, await self._fit_context(phase, model, messages)
+            send, options = self._upstream_request(phase, model, messages, params)
+            span.model, completion = await self.upstream.acall(phase, model, send, **options)
+            return self._upstream_reply(span, phase, model, requested, params, key, completion)
+
+    async def _spanned_stream(self, span, phase, model, stream):
+        """Pass a stream's chunks through, counting the usage of its last one and closing its span at the end"""
+        try:
+            async for chunk in stream:
+                self._record_usage(phase, model, span.usage(chunk))
+                yield chunk
+        except Exception:
+            span.outcome = "error"
+            raise
+        finally:
+            span.close()
+
+    async def _fit_context(self, phase, model, messages):
+        """Messages to send so that the request fits the model's context budget"""
+        plan = self._context_plan(phase, model, messages)
+        if plan is None or not plan.needs_summary:
+            return messages if plan is None else plan.messages
+        try:
+            completion = await self._complete("summarize_context", self.assistant_model, plan.summary_request(),
+                                              max_completion_tokens=self.context.summary_tokens)
+        except Exception as e:
+            return self._summary_failed(plan, e)
+        return plan.with_summary(completion.choices[0].message.content)
+
+    async def get_response(self, user_input):
+        """Get a response from the chatbot"""
+        refused = self._begin_response(user_input)
+        if refused is not None:
+            return refused
+
+        try:
+            completion = await self._complete("get_response", self.assistant_model, self.conversation_history)
+            return self._responded(completion.choices[0].message.content)
+        except Exception as e:
+            return self._response_failed(e)
+
+    async def get_response_stream(self, user_input):
+        """Stream a response from the chatbot, yielding text as it arrives"""
+        refused = self._begin_response(user_input)
+        if refused is not None:
+            yield refused
+            return
+
+        started, chunks = time.perf_counter(), []
+        try:
+            stream = await self._complete("get_response", self.assistant_model, self.conversation_history, **self.STREAM_PARAMS)
+            async for chunk in stream:
+                delta = self._stream_delta(chunk, started)
+                if delta:
+                    chunks.append(delta)
+                    yield delta
+        except Exception as e:
+            yield self._response_failed(e)
+            return
+
+        self._responded("".join(chunks))
+
+    async def process_input(self, user_input):
+        """Process input based on reasoning mode"""
+        if self.reasoning_enabled:
+            return await self.multi_agent_response(user_input)
+        else:
+            return await self.get_response(user_input)
+
+    async def execute_reasoning_step(self, step_prompt):
+        """Execute a single reasoning step"""
+        self.add_message_assistant("user", self._step_prompt(step_prompt))
+        assistant_response = await self._run_step(self.conversation_history)
+        self.add_message_assistant("assistant", assistant_response)
+
+        return assistant_response
+
+    async def _run_step(self, messages):
+        """Ask the assistant to answer the last step prompt in messages"""
+        completion = await self._complete("execute_reasoning_step", self._model("execute_reasoning_step"), messages)
+        return completion.choices[0].message.content
+
+    async def execute_plan(self, steps, dependencies=None):
+        """Execute the plan's steps, running the ones that do not depend on each other concurrently"""
+        graph = StepGraph(steps, dependencies)
+        base = list(self.conversation_history)
+        results = {}
+        tasks = []
+        limit = asyncio.Semaphore(max(1, self.max_parallel_steps))
+
+        async def run(index):
+            # Dependencies always point at earlier steps, whose tasks already exist
+            await asyncio.gather(*(tasks[dependency] for dependency in graph.dependencies[index]))
+            async with limit:
+                messages = self._step_started(base, graph, index, results)
+                self._step_finished(graph, index, results, await self._run_step(messages))
+
+        for index in range(len(graph)):
+            tasks.append(asyncio.ensure_future(run(index)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return self._merge_steps(graph, results)
+
+    async def analyze_input(self, user_input):
+        """Analyze the input to determine the appropriate reasoning approach"""
+        reused, messages = self._plan_request(user_input)
+        if reused is not None:
+            return reused
+
+        completion = await self._complete(
+            "analyze_input",
+            self.supervisor_model,
+            messages,
+            response_format=self.SupervisorJSON
+        )
+        return self._planned(user_input, completion)
+
+    async def generate_critical_analysis(self):
+        """Generate critical analysis and alternative viewpoints"""
+        messages = self._critique_messages()
+        completion = await self._complete(
+            "generate_critical_analysis",
+            self._model("generate_critical_analysis"),
+            messages,
+            response_format=self.SupervisorRater,
+            max_completion_tokens=400
+        )
+        return self._critique_answered(messages, completion)
+
+    async def reasoning_response(self, critical_analysis, steps):
+        """Synthesize a final response incorporating all perspectives"""
+        self.add_message_assistant("user", self._synthesis_prompt(critical_analysis, steps), name="supervisor")
+        completion = await self._complete("reasoning_response", self._model("reasoning_response"), self.conversation_history)
+        self.add_message_assistant("assistant", completion.choices[0].message.content)
+
+    async def multi_agent_response(self, user_input):
+        """Enhanced reasoning process with critical analysis"""
+        self._begin_run()
+        try:
+            return await self._reason(user_input)
+        finally:
+            self._clear_run()
+
+    async def _plan_failed(self, error, user_input, seeded):
+        """Answer directly when the plan could not be made or carried out, dropping what the run added to the history"""
+        self._unplanned(error, seeded)
+        return self._finish_run("upstream_error", await self.get_response(user_input), direct=True)
+
+    async def _reason(self, user_input):
+        """One reasoning run: plan, steps, then critique and refinement rounds until a stop condition"""
+        limit = self._session_spent(user_input)
+        if limit:
+            return self._finish_run(limit, self._budget_reply(limit), direct=True)
+
+        if self._takes_fast_path(user_input):
+            return self._finish_run("fast_path", await self.get_response(user_input), direct=True, fast_path=True)
+
+        seeded = len(self.conversation_history)
+        try:
+            analysis = await self.analyze_input(user_input)
+        except Exception as e:
+            return await self._plan_failed(e, user_input, seeded)
+
+        stopped_by = self._plan_stopped(analysis)
+        if stopped_by:
+            return self._finish_run(stopped_by, await self.get_response(user_input), direct=True)
+
+        self._start_reasoning(user_input, analysis)
+        try:
+            await self.execute_plan(analysis.parsed.steps, analysis.parsed.dependencies)
+        except Exception as e:
+            return await self._plan_failed(e, user_input, seeded)
+
+        stopped_by = self._budget_exhausted()
+        while stopped_by is None:
+            self._run.add_round()
+            steps = self._run.rounds
+            try:
+                critical_analysis = await self.generate_critical_analysis()
+                stopped_by = self._review_stopped(critical_analysis, steps)
+                if stopped_by:
+                    break
+                await self.reasoning_response(critical_analysis.instructions, steps)
+            except Exception as e:
+                stopped_by = self._upstream_failed(e)
+                break
+            stopped_by = self._refined(steps)
+
+        return self._reasoned(stopped_by)
+
+
+class BackgroundLoop:
+    """An asyncio event loop running in a daemon thread, fed from synchronous code"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="asyncio-loop", daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop and return a concurrent future for its result"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(self._report)
+        return future
+
+    def _report(self, future):
+        """Print errors from fire-and-forget coroutines instead of losing them"""
+        if not future.cancelled() and future.exception() is not None:
+            traceback.print_exception(future.exception())
+
+    def stop(self):
+        """Stop the loop and wait for its thread"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
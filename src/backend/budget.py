@@ -0,0 +1,105 @@
+# budget.py
+import os
+import threading
+import time
+
+from backend.pricing import cost
+
+# Limits in the order they are reported when several are hit at once
+LIMITS = ("max_rounds", "deadline", "max_input_tokens", "max_output_tokens", "max_cost")
+
+
+def _env_number(name, cast):
+    value = os.getenv(name)
+    return cast(value) if value not in (None, "") else None
+
+
+class Budget:
+    """Hard limits for one request or one session; None means unlimited"""
+
+    def __init__(self, max_rounds=None, deadline=None, max_input_tokens=None, max_output_tokens=None, max_cost=None):
+        self.max_rounds = max_rounds
+        self.deadline = deadline
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.max_cost = max_cost
+
+    @classmethod
+    def from_env(cls, prefix, **defaults):
+        """Read e.g. REQUEST_MAX_ROUNDS, REQUEST_DEADLINE, REQUEST_MAX_COST"""
+        values = {
+            "max_rounds": _env_number(f"{prefix}MAX_ROUNDS", int),
+            "deadline": _env_number(f"{prefix}DEADLINE", float),
+            "max_input_tokens": _env_number(f"{prefix}MAX_INPUT_TOKENS", int),
+            "max_output_tokens": _env_number(f"{prefix}MAX_OUTPUT_TOKENS", int),
+            "max_cost": _env_number(f"{prefix}MAX_COST", float),
+        }
+        return cls(**{name: defaults.get(name) if value is None else value for name, value in values.items()})
+
+
+class BudgetTracker:
+    """Usage of one request or session measured against its Budget
+
+    A request tracker forwards everything it records to its parent, the
+    session tracker, so both are enforced together.
+    """
+
+    def __init__(self, budget, parent=None, scope="request"):
+        self.budget = budget
+        self.parent = parent
+        self.scope = scope
+        self.started = time.monotonic()
+        self.rounds = 0
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, model, prompt_tokens, completion_tokens, cached_tokens=0):
+        """Add the usage of one upstream call"""
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += prompt_tokens
+            self.output_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+            self.cost += cost(model, prompt_tokens, completion_tokens, cached_tokens)
+        if self.parent is not None:
+            self.parent.record(model, prompt_tokens, completion_tokens, cached_tokens)
+
+    def add_round(self):
+        """Count one critique round"""
+        with self._lock:
+            self.rounds += 1
+        if self.parent is not None:
+            self.parent.add_round()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def exceeded(self, ignore=()):
+        """Name of the first limit reached, prefixed with the scope, or None"""
+        budget = self.budget
+        reached = {
+            "max_rounds": budget.max_rounds is not None and self.rounds >= budget.max_rounds,
+            "deadline": budget.deadline is not None and self.elapsed() >= budget.deadline,
+            "max_input_tokens": budget.max_input_tokens is not None and self.input_tokens >= budget.max_input_tokens,
+            "max_output_tokens": budget.max_output_tokens is not None and self.output_tokens >= budget.max_output_tokens,
+            "max_cost": budget.max_cost is not None and self.cost >= budget.max_cost,
+        }
+        for limit in LIMITS:
+            if reached[limit] and limit not in ignore:
+                return f"{self.scope}_{limit}"
+        return self.parent.exceeded(ignore) if self.parent is not None else None
+
+    def report(self):
+        return {
+            "rounds": self.rounds,
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cost": round(self.cost, 6),
+            "elapsed": round(self.elapsed(), 3),
+        }
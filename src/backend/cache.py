@@ -0,0 +1,185 @@
+# cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from openai.types.chat import ChatCompletion
+from openai.types.chat.parsed_chat_completion import ParsedChatCompletion
+
+
+def request_key(model, messages, response_format=None, **params):
+    """Canonical hash of everything that determines an upstream reply"""
+    request = {
+        "model": model,
+        "messages": [dict(message) for message in messages],
+        "response_format": None if response_format is None else {
+            "name": response_format.__name__,
+            "schema": response_format.model_json_schema(),
+        },
+        "params": params,
+    }
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def dump_completion(completion):
+    """Serialize a completion, parsed or not, to compact JSON"""
+    return completion.model_dump_json(exclude_none=True)
+
+
+def load_completion(data, response_format=None):
+    """Rebuild a completion serialized by dump_completion"""
+    if response_format is None:
+        return ChatCompletion.model_validate_json(data)
+    return ParsedChatCompletion[response_format].model_validate_json(data)
+
+
+class CompletionCache:
+    """Two-tier cache of upstream replies: an in-memory LRU in front of a SQLite file
+
+    Both tiers expire entries after their TTL and evict least recently used
+    entries once over their size limits.
+    """
+
+    def __init__(self, path=None, max_entries=1024, max_bytes=32 * 1024 * 1024, ttl=3600,
+                 disk_max_bytes=512 * 1024 * 1024, disk_ttl=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_ttl = disk_ttl
+
+        # key -> (value, stored_at), ordered from least to most recently used
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "stored_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if now - stored_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats["hits_memory"] += 1
+                    return value
+                self._forget(key)
+                self.stats["expired"] += 1
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, stored_at FROM completions WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] < self.disk_ttl:
+                    self._db.execute("UPDATE completions SET used_at = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    # Promote to memory, keeping the original age
+                    self._remember(key, row[0], row[1])
+                    self.stats["hits_disk"] += 1
+                    return row[0]
+                if row is not None:
+                    self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                    self._db.commit()
+                    self.stats["expired"] += 1
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        """Store a value in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self.stats["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO completions (key, value, size, stored_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value.encode("utf-8")), now, now),
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+    def _remember(self, key, value, stored_at):
+        """Insert into the memory tier and evict over its limits"""
+        self._forget(key)
+        self._memory[key] = (value, stored_at)
+        self._memory_bytes += len(value.encode("utf-8"))
+        while self._memory and (len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes):
+            self._forget(next(iter(self._memory)))
+            self.stats["evictions_memory"] += 1
+
+    def _forget(self, key):
+        """Drop a key from the memory tier"""
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[0].encode("utf-8"))
+
+    def _evict_disk(self, now):
+        """Delete expired rows, then least recently used ones over the size limit"""
+        expired = self._db.execute("DELETE FROM completions WHERE stored_at < ?", (now - self.disk_ttl,)).rowcount
+        self.stats["expired"] += max(expired, 0)
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total <= self.disk_max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM completions ORDER BY used_at").fetchall():
+            if total <= self.disk_max_bytes:
+                break
+            self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+            total -= size
+            self.stats["evictions_disk"] += 1
+
+    def report(self):
+        """Hit/miss counters and the size of each tier"""
+        with self._lock:
+            report = dict(self.stats)
+            report["entries_memory"] = len(self._memory)
+            report["bytes_memory"] = self._memory_bytes
+            if self._db is not None:
+                entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+                report["entries_disk"] = entries
+                report["bytes_disk"] = size
+        lookups = report.get("hits_memory", 0) + report.get("hits_disk", 0) + report.get("misses", 0)
+        report["hit_rate"] = round((lookups - report.get("misses", 0)) / lookups, 3) if lookups else None
+        return report
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache():
+    """The process-wide completion cache, configured from the environment"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = CompletionCache(
+                path=os.getenv("CACHE_PATH", "data/completions.sqlite3") or None,
+                max_entries=int(os.getenv("CACHE_MAX_ENTRIES", 1024)),
+                max_bytes=int(os.getenv("CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+                ttl=float(os.getenv("CACHE_TTL", 3600)),
+                disk_max_bytes=int(os.getenv("CACHE_DISK_MAX_BYTES", 512 * 1024 * 1024)),
+                disk_ttl=float(os.getenv("CACHE_DISK_TTL", 7 * 24 * 3600)),
+            )
+        return _shared
+
+
+def cached_phases():
+    """Phases whose replies may be cached, e.g. CACHE_PHASES=analyze_input,execute_reasoning_step"""
+    return {phase.strip() for phase in os.getenv("CACHE_PHASES", "").split(",") if phase.strip()}
@@ -0,0 +1,174 @@
+# cassette.py
+import atexit
+import gzip
+import json
+import os
+import threading
+from collections import Counter, defaultdict, deque
+
+from openai.types.chat import ChatCompletionChunk
+
+from backend.cache import dump_completion, load_completion, request_key
+
+
+class CassetteMiss(LookupError):
+    """A replayed request that was never recorded"""
+
+
+def _open(path, mode):
+    """Open a cassette file, gzip-compressed when its name ends in .gz"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class _AsyncChunks:
+    """Replayed stream chunks as an async iterator, like AsyncStream"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class Cassette:
+    """Records upstream request/reply pairs to a JSONL file, or replays them without any network
+
+    Requests are matched on the same canonical hash as the completion cache:
+    model, messages, structured-output schema and parameters. A request
+    recorded several times is replayed in recording order. With `fallback`, a
+    request whose hash was never recorded gets the next unused reply recorded
+    for the same phase and model, so runs still replay after prompt changes.
+    """
+
+    def __init__(self, path, mode="replay", fallback=False):
+        self.path = path
+        self.mode = mode
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+        # key -> replies not replayed yet, and the last one for repeats past the end
+        self._replies = defaultdict(deque)
+        self._last = {}
+        # (phase, model) -> replies in recording order, for fallback matching
+        self._by_phase = defaultdict(deque)
+
+        self._writer = None
+        if mode == "replay":
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            atexit.register(self.close)
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def _load(self):
+        with _open(self.path, "r") as cassette:
+            for line in cassette:
+                entry = json.loads(line)
+                self._replies[entry["key"]].append(entry)
+                self._last[entry["key"]] = entry
+                self._by_phase[(entry["phase"], entry["model"])].append(entry)
+                self.stats["loaded"] += 1
+
+    def _find(self, key, phase, model):
+        """The recorded entry to answer a request with"""
+        with self._lock:
+            if self._replies[key]:
+                entry = self._replies[key].popleft()
+                self.stats["replayed"] += 1
+            elif key in self._last:
+                entry = self._last[key]
+                self.stats["repeated"] += 1
+            elif self.fallback and self._by_phase[(phase, model)]:
+                entry = self._by_phase[(phase, model)].popleft()
+                self.stats["fallbacks"] += 1
+            else:
+                self.stats["misses"] += 1
+                raise CassetteMiss(f"no recorded reply for {phase} on {model} ({key[:12]})")
+            return entry
+
+    def replay(self, phase, model, messages, params, asynchronous=False):
+        """The recorded reply to a request: a completion, or an iterator of chunks for streams"""
+        entry = self._find(request_key(model, messages, **params), phase, model)
+        if entry["stream"]:
+            chunks = [ChatCompletionChunk.model_validate_json(chunk) for chunk in entry["reply"]]
+            return _AsyncChunks(chunks) if asynchronous else iter(chunks)
+        return load_completion(entry["reply"], params.get("response_format"))
+
+    def _write(self, key, phase, model, stream, reply):
+        line = json.dumps({"key": key, "phase": phase, "model": model, "stream": stream, "reply": reply},
+                          ensure_ascii=False)
+        with self._lock:
+            # One open writer keeps a gzip cassette compact; it is flushed every few entries
+            if self._writer is None:
+                self._writer = _open(self.path, "a")
+            self._writer.write(line + "\n")
+            self.stats["recorded"] += 1
+            if self.stats["recorded"] % 20 == 0:
+                self._writer.flush()
+
+    def close(self):
+        """Finish the cassette file"""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def record(self, phase, model, messages, params, completion):
+        """Record a reply; streams are passed through and written once they finish"""
+        key = request_key(model, messages, **params)
+        if not params.get("stream"):
+            self._write(key, phase, model, False, dump_completion(completion))
+            return completion
+        if hasattr(completion, "__aiter__"):
+            return self._record_async_stream(key, phase, model, completion)
+        return self._record_stream(key, phase, model, completion)
+
+    def _record_stream(self, key, phase, model, stream):
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk.model_dump_json(exclude_none=True))
+            yield chunk
+        self._write(key, phase, model, True, chunks)
+
+    async def _record_async_stream(self, key, phase, model, stream):
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk.model_dump_json(exclude_none=True))
+            yield chunk
+        self._write(key, phase, model, True, chunks)
+
+    def report(self):
+        with self._lock:
+            return {"mode": self.mode, "path": self.path, "fallback": self.fallback, **self.stats}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_cassette():
+    """The process-wide cassette when CASSETTE is record or replay, otherwise None"""
+    global _shared
+    mode = os.getenv("CASSETTE", "off")
+    if mode not in ("record", "replay"):
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = Cassette(
+                path=os.getenv("CASSETTE_PATH", "data/cassette.jsonl.gz"),
+                mode=mode,
+                fallback=os.getenv("CASSETTE_FALLBACK", "0") == "1",
+            )
+        return _shared
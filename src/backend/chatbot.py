@@ -1,9 +1,35 @@
 # chatbot.py
-from openai import OpenAI
+from openai.types.chat.parsed_chat_completion import ParsedChatCompletionMessage
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from uuid import uuid4
+import copy
+import logging
 import os
+import time
 
+from backend.budget import Budget, BudgetTracker
+from backend.cache import cached_phases, dump_completion, load_completion, request_key, shared_cache
+from backend.cassette import shared_cassette
+from backend.context import shared_context_window
+from backend.convergence import shared_convergence
+from backend.digest import ReasoningDigest, condense
+from backend.fastpath import shared_router
+from backend.history import History
+from backend.ledger import shared_ledger, token_counts
+from backend.metrics import shared_metrics
+from backend.model_router import shared_model_router
+from backend.plan import StepGraph
+from backend.plan_index import shared_plan_index
+from backend.prompt_layout import cache_hints, shared_prompt_cache
+from backend.ratelimit import COMPLETION_ESTIMATE
+from backend.similarity import text_similarity
+from backend.tokens import messages_tokens
+from backend.transport import openai_client
+from backend.upstream import shared_upstream
+
+log = logging.getLogger(__name__)
 
 
 assistant_prompt ="""You are a reasoning Assistant, designed to solve problems by following the guidance and supervision of Supervisor, another model responsible for overseeing your thought process. Your primary responsibilities include:
@@ -72,29 +98,147 @@ Objective:
     You should always ask what could go wrong! Never assume an initial resposne is correct,and never rate the satsifaction or accuracy high in first reasoning step!
 """
 
+analysis_instructions = """Analyze the following input for the Server and determine:
+        1. Is this a question or a conversational statement?
+        2. What type of reasoning steps would be most appropriate?
+        3. What different perspectives should be considered?
+        4. List the suggested initial reasoning steps in order.
+        5. For each step, list the numbers (starting at 1) of the earlier steps whose results it needs. Leave the list empty when the step can be worked on independently, for example when it examines one perspective on its own.
+        6. Give extra explanation about the user prompt, inlcuding hat they ar asking exactly, and how it is usually answered. Do not try answering the prompt directly, rather analyze the user prompt carefully and explain how such prompt or quesion is usually answered, and break it into smaller parts.
+
+        Format your response as JSON:
+        {
+            "is_question": true/false,
+            "complexity": "simple/medium/complex",
+            "reasoning_type": "logical/analytical/creative/etc",
+            "perspectives": ["perspective1", "perspective2", ...],
+            "steps": ["step1", "step2", ...],
+            "dependencies": [[], [1], ...],
+            "explanation": "extra explanation"
+        }
+
+        """
+
+critique_instructions = """Ther Server followed your suggested steps and came up with the responses below.
+
+        Critically analyze the response. Provide a detailed analysis of the response, highlighting any logical flaws, assumptions, or missing information. Give actionable insights.
+
+        Your output should be in the followinf JSON format:
+        {
+            "satisfaction": "high/medium/low",
+            "accuracy": "high/medium/low",
+            "instructions": "detailed analysis and actionable instructions",
+            "failure": true/false
+        }
+
+        You should not acknowledge whether the respose is correct or not, but rather focus on the reasoning process and the clarity of the response.
+        You should rate high in accuracy only if there is no way to challenge the response critically and every aspect is considered!
+        Also only rate high in satisfaction if the response has shown a reasonable thought process, otherwise, if it is not clear how it was reached, rate low in satisfaction.
+        Check the thought process and see if it is logically sound. There should be a thought process.
+        Give exact instructions on how to improve the response and get a better rating on accuracy and satisfaction.
+
+        If the server's response is not stil satisfying or accurate after 5 reasoning steps in the chat history, put the failure to true.
+        """
+
+# Supervisor ratings as numbers, to find the best reviewed answer of a run
+RATINGS = {"low": 0, "medium": 1, "high": 2}
+
+# Ways a run ends on its own terms, rather than cut short by an error or a budget
+COMPLETED_STOPS = {"settled", "converged", "request_max_rounds", "session_max_rounds"}
+
 class Chatbot:
+    # Whether the client and replayed replies are asynchronous; AsyncChatbot sets it
+    asynchronous = False
+    # Streamed replies ask for a final usage chunk, so their tokens are counted
+    STREAM_PARAMS = {"stream": True, "stream_options": {"include_usage": True}}
+
     def __init__(self):
         # Load environment variables from .env file
         load_dotenv("env/.env")
         
         # Initialize OpenAI client
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=os.getenv("API_KEY"),
-        )
-        self.assistant_model = "openai/gpt-3.5-turbo"
-        self.supervisor_model = "openai/gpt-4o"
+        self.client = self._make_client()
+        # Timeouts, retries and hedging shared by every upstream call
+        self.upstream = shared_upstream()
+        # Records upstream replies to a file, or replays them instead of calling upstream
+        self.cassette = shared_cassette()
+        self.assistant_model = os.getenv("ASSISTANT_MODEL", "openai/gpt-3.5-turbo")
+        self.supervisor_model = os.getenv("SUPERVISOR_MODEL", "openai/gpt-4o")
+        # Picks the models of each reasoning run from MODEL_POOL; without one the two models above are used
+        self.model_router = shared_model_router()
+        self._phase_models = {}
         self.assistant_prompt = assistant_prompt
         self.supervisor_prompt = supervisor_prompt
 
         # Initialize conversation history and system prompt
-        self.conversation_history = []
+        self.conversation_history = History()
         self.conversation_history.append({"role": "system", "content": self.assistant_prompt})
 
-        self.reasoning_history = []
+        self.reasoning_history = History()
         self.reasoning_history.append({"role": "system", "content": self.supervisor_prompt})
 
         self.reasoning_enabled = False  # Default state
+
+        # In reasoning mode, answer directly first and refine in the background
+        self.answer_first_enabled = os.getenv("ANSWER_FIRST", "0") == "1"
+        # A refined answer less similar than this to the draft is pushed as a revision
+        self.revision_threshold = float(os.getenv("REVISION_THRESHOLD", 0.8))
+
+        # Seconds until the first streamed token of the last streamed reply
+        self.last_ttft = None
+        # Upstream error that spoiled the last request's reply, or None when it was answered
+        self.last_error = None
+
+        # Optional callback(event, data) notified as a reasoning run progresses
+        self.on_progress = None
+
+        # Replies of these phases are served from the completion cache when possible
+        self.cache_phases = cached_phases()
+        self.cache = shared_cache() if self.cache_phases else None
+
+        # Plans made for earlier, near-identical opening questions are reused without asking the supervisor
+        self.plan_index = shared_plan_index()
+
+        # Keeps every request within the model's token budget by folding old turns into a summary
+        self.context = shared_context_window()
+
+        # Local classifier that lets small talk and simple lookups skip the supervisor
+        self.fast_path = shared_router()
+        # (input, skips) routed by would_reason, so the run on that input does not route and count it again
+        self._routed = None
+
+        # "delta" critiques only show the supervisor what changed since its last review, "full" the whole chat
+        self.critique_mode = os.getenv("CRITIQUE_MODE", "delta")
+        # "stable" keeps supervisor request prefixes byte-identical across calls and adds provider cache hints
+        self.prompt_layout = os.getenv("PROMPT_LAYOUT", "inline")
+        self.prompt_cache = shared_prompt_cache()
+        self._reset_critique()
+
+        # Independent plan steps are executed concurrently, at most this many at once
+        self.max_parallel_steps = int(os.getenv("MAX_PARALLEL_STEPS", 4))
+
+        # Hard limits on each reasoning run and on the whole session; usage counts against both
+        self.request_budget = Budget.from_env("REQUEST_", max_rounds=5, deadline=120)
+        self.session_usage = BudgetTracker(Budget.from_env("SESSION_"), scope="session")
+        self._run = None
+        self._best = None
+        self._last_score = None
+        self._converging = None
+        self._refinements = 0
+        # Rounds, usage and stop reason of the last reasoning run
+        self.last_run = None
+
+        # Stops refining once new rounds barely change the answer and the ratings stall
+        self.convergence = shared_convergence()
+
+        # Timing spans of every upstream phase call, and run counters, for /metrics
+        self.metrics = shared_metrics()
+
+        # Priced usage of every upstream call, by request and session; the session manager sets the id to its key
+        self.ledger = shared_ledger()
+        self.session_id = uuid4().hex
+        self.request_id = None
+        self.request_mode = None
         
     class SupervisorJSON(BaseModel):
         is_question: str
@@ -102,6 +246,7 @@ class Chatbot:
         reasoning_type: str
         perspectives: list[str]
         steps: list[str]
+        dependencies: list[list[int]]
         explanation: str
 
     class SupervisorRater(BaseModel):
@@ -110,6 +255,154 @@ class Chatbot:
         instructions: str
         failure: bool
 
+    def _make_client(self):
+        """Create the OpenRouter client, sharing the process-wide connection pool"""
+        return openai_client()
+
+    def _complete(self, phase, model, messages, **params):
+        """Send one upstream request for the given phase, parsing it when a response_format is given"""
+        with self.metrics.span(phase, model) as span:
+            key, local = self._local_reply(span, phase, model, messages, params)
+            if local is not None:
+                return local
+
+            requested, messages = messages, self._fit_context(phase, model, messages)
+            send, options = self._upstream_request(phase, model, messages, params)
+            span.model, completion = self.upstream.call(phase, model, send, **options)
+            return self._upstream_reply(span, phase, model, requested, params, key, completion)
+
+    def _local_reply(self, span, phase, model, messages, params):
+        """Return (cache key, reply) where the reply is replayed or cached, or None when upstream must be asked"""
+        if self.cassette is not None and self.cassette.replaying:
+            span.outcome = "replayed"
+            completion = self.cassette.replay(phase, model, messages, params, asynchronous=self.asynchronous)
+            if params.get("stream"):
+                return None, self._spanned_stream(span.detach(), phase, model, completion)
+            self._record_usage(phase, model, span.usage(completion))
+            return None, completion
+
+        key, cached = self._cache_lookup(phase, model, messages, params)
+        if cached is not None:
+            span.outcome = "cached"
+            return key, self._record_reply(phase, model, messages, params, cached)
+        return key, None
+
+    def _upstream_request(self, phase, model, messages, params):
+        """(send, upstream call options) for a request of messages that already fits the model's context"""
+        if self.prompt_layout == "stable":
+            messages = cache_hints(model, messages)
+        if "response_format" in params:
+            send = lambda model, timeout: self.client.beta.chat.completions.parse(model=model, messages=messages, timeout=timeout, **params)
+        else:
+            send = lambda model, timeout: self.client.chat.completions.create(model=model, messages=messages, timeout=timeout, **params)
+        # Streams are retried until they open but never hedged
+        return send, {"deadline": self._time_left(), "hedge": not params.get("stream"),
+                      "tokens": self._request_tokens(messages, params)}
+
+    def _upstream_reply(self, span, phase, model, requested, params, key, completion):
+        """Account for an upstream reply from span.model and return it, cached and recorded"""
+        if params.get("stream"):
+            # The span stays open until the stream is consumed, so it times the whole reply and gets its usage
+            completion = self._record_reply(phase, model, requested, params, completion)
+            return self._spanned_stream(span.detach(), phase, span.model, completion)
+
+        self._record_usage(phase, span.model, span.usage(completion))
+        self._cache_store(key, completion)
+        return self._record_reply(phase, model, requested, params, completion)
+
+    def _spanned_stream(self, span, phase, model, stream):
+        """Pass a stream's chunks through, counting the usage of its last one and closing its span at the end"""
+        try:
+            for chunk in stream:
+                self._record_usage(phase, model, span.usage(chunk))
+                yield chunk
+        except Exception:
+            span.outcome = "error"
+            raise
+        finally:
+            span.close()
+
+    def _request_tokens(self, messages, params):
+        """Tokens a request is expected to use, charged against its model's tokens per minute"""
+        return messages_tokens(messages) + params.get("max_completion_tokens", COMPLETION_ESTIMATE)
+
+    def _record_reply(self, phase, model, messages, params, completion):
+        """Write a reply to the cassette when recording, cache hits included, so a replay never misses it"""
+        if self.cassette is None:
+            return completion
+        return self.cassette.record(phase, model, messages, params, completion)
+
+    def _record_usage(self, phase, model, completion):
+        """Count the tokens of an upstream reply against the run and session budgets, and in the ledger"""
+        counts = token_counts(completion)
+        if counts is None:
+            return
+        tracker = self._run or self.session_usage
+        tracker.record(model, *counts)
+        self.ledger.record(self.session_id, self.request_id, self.request_mode, phase, model, *counts)
+
+    def _begin_request(self, mode):
+        """Start a new request in the ledger, unless a reasoning run is already in progress"""
+        if mode == "reasoning" or self._run is None:
+            self.request_id = uuid4().hex[:16]
+            self.request_mode = mode
+            self.last_error = None
+
+    def _time_left(self):
+        """Seconds left before the current run's deadline, or None without one"""
+        if self._run is None or self._run.budget.deadline is None:
+            return None
+        return self._run.budget.deadline - self._run.elapsed()
+
+    def _session_limit(self):
+        """The session limit that forbids any further upstream call, or None"""
+        # Running out of session rounds only stops reasoning, direct replies are still allowed
+        return self.session_usage.exceeded(ignore=("max_rounds",))
+
+    @staticmethod
+    def _budget_reply(limit):
+        """Reply given instead of an upstream call once the session budget is spent"""
+        return f"This session has reached its budget ({limit}), no further requests can be made."
+
+    def _fit_context(self, phase, model, messages):
+        """Messages to send so that the request fits the model's context budget"""
+        plan = self._context_plan(phase, model, messages)
+        if plan is None or not plan.needs_summary:
+            return messages if plan is None else plan.messages
+        try:
+            completion = self._complete("summarize_context", self.assistant_model, plan.summary_request(),
+                                        max_completion_tokens=self.context.summary_tokens)
+        except Exception as e:
+            return self._summary_failed(plan, e)
+        return plan.with_summary(completion.choices[0].message.content)
+
+    def _context_plan(self, phase, model, messages):
+        """How a request is fitted to the model's context budget, or None when it is sent as is"""
+        if self.context is None or phase == "summarize_context":
+            return None
+        return self.context.plan(model, messages)
+
+    def _summary_failed(self, plan, error):
+        """A failed summary must not fail the request itself, the old turns are dropped instead"""
+        log.warning("Context summary failed: %s", error)
+        self.metrics.recovered("context_summary")
+        return plan.without_summary()
+
+    def _cache_lookup(self, phase, model, messages, params):
+        """Return (key, cached completion) for a cacheable request, the key is None otherwise"""
+        if self.cache is None or phase not in self.cache_phases or params.get("stream"):
+            return None, None
+        key = request_key(model, messages, **params)
+        cached = self.cache.get(key)
+        if cached is None:
+            return key, None
+        return key, load_completion(cached, params.get("response_format"))
+
+    def _cache_store(self, key, completion):
+        """Remember a completion fetched for a cacheable request"""
+        if key is not None:
+            self.cache.put(key, dump_completion(completion))
+
     def add_message_supervisor(self, role, content, name=None):
         """Add a message to the conversation history for supervisor"""
         self.reasoning_history.append({"role": role, "content": content}) if name is None else self.reasoning_history.append({"role": role, "name": name, "content": content})
@@ -120,192 +413,615 @@ class Chatbot:
         
     def get_response(self, user_input):
         """Get a response from the chatbot"""
-        # Add user input to conversation history
-        self.add_message_assistant("user", user_input)
-        
+        refused = self._begin_response(user_input)
+        if refused is not None:
+            return refused
+
         try:
-            # Get completion from OpenAI
-            completion = self.client.chat.completions.create(
-                model=self.assistant_model,
-                messages=self.conversation_history
-            )
-            
-            # Get the assistant's response
-            assistant_response = completion.choices[0].message.content
-            
-            # Add assistant's response to conversation history
-            self.add_message_assistant("assistant", assistant_response)
-            
-            return assistant_response
-            
+            completion = self._complete("get_response", self.assistant_model, self.conversation_history)
+            return self._responded(completion.choices[0].message.content)
         except Exception as e:
-            return f"An error occurred: {str(e)}"
-    
+            return self._response_failed(e)
+
+    def get_response_stream(self, user_input):
+        """Stream a response from the chatbot, yielding text as it arrives"""
+        refused = self._begin_response(user_input)
+        if refused is not None:
+            yield refused
+            return
+
+        started, chunks = time.perf_counter(), []
+        try:
+            stream = self._complete("get_response", self.assistant_model, self.conversation_history, **self.STREAM_PARAMS)
+            for chunk in stream:
+                delta = self._stream_delta(chunk, started)
+                if delta:
+                    chunks.append(delta)
+                    yield delta
+        except Exception as e:
+            yield self._response_failed(e)
+            return
+
+        # The reply only enters the history once, after the stream has finished
+        self._responded("".join(chunks))
+
+    def _begin_response(self, user_input):
+        """Start a direct reply to user_input; returns the budget reply given instead when the session is spent"""
+        self._begin_request("standard")
+        self.add_message_assistant("user", user_input)
+        self.last_ttft = None
+        limit = self._session_limit()
+        if not limit:
+            return None
+        return self._responded(self._budget_reply(limit))
+
+    def _responded(self, assistant_response):
+        """Add a direct reply to the history and return it"""
+        self.add_message_assistant("assistant", assistant_response)
+        return assistant_response
+
+    def _response_failed(self, error):
+        """The reply given when the upstream call of a direct reply failed"""
+        self.last_error = str(error)
+        return f"An error occurred: {str(error)}"
+
+    def _stream_delta(self, chunk, started):
+        """Text carried by one streamed chunk, if any; the first one sets the time to first token"""
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            return None
+        if self.last_ttft is None:
+            self.last_ttft = time.perf_counter() - started
+            self.metrics.ttft.observe(self.last_ttft, phase="get_response", model=self.assistant_model)
+        return chunk.choices[0].delta.content
+
     def clear_history(self):
         """Clear the conversation history"""
-        self.conversation_history = []
+        self.conversation_history = History()
         self.conversation_history.append({"role": "system", "content": self.assistant_prompt})
+        self._reset_critique()
+
+    def _reset_critique(self):
+        """Forget what the supervisor has reviewed"""
+        # Messages before the mark are only shown to the supervisor through the digest
+        self.critique_digest = ReasoningDigest()
+        self._critique_mark = 1
+        self._critique_round = 0
+        self._run_question = None
+        # Earlier review requests and replies of this run, repeated verbatim in the stable layout
+        self._critique_thread = []
 
     def toggle_reasoning(self):
         """Toggle reasoning mode on/off"""
         self.reasoning_enabled = not self.reasoning_enabled
         return self.reasoning_enabled
-        
+
+    def toggle_answer_first(self):
+        """Toggle answer-first reasoning on/off"""
+        self.answer_first_enabled = not self.answer_first_enabled
+        return self.answer_first_enabled
+
+    def fork(self):
+        """Copy of this chatbot with its own histories, sharing the client and settings"""
+        forked = copy.copy(self)
+        forked.conversation_history = self.conversation_history.copy()
+        forked.reasoning_history = self.reasoning_history.copy()
+        forked.critique_digest = self.critique_digest.copy()
+        forked._critique_thread = list(self._critique_thread)
+        forked.on_progress = None
+        # A routing decision made for the next run moves to the copy that will make it
+        self._routed = None
+        return forked
+
+    def is_material_revision(self, draft, refined):
+        """Whether a refined answer differs enough from the draft to be worth showing"""
+        return bool(refined) and text_similarity(draft, refined) < self.revision_threshold
+
+    def run_completed(self):
+        """Whether the last reasoning run refined its answer at least once and ended on its own terms
+
+        Only such an answer may replace an answer-first draft; a run cut short
+        before its first refinement only has a step's output to offer.
+        """
+        run = self.last_run
+        return bool(run) and not run["direct"] and run["refinements"] > 0 and run["stopped_by"] in COMPLETED_STOPS
+
+    def revise_reply(self, draft, refined):
+        """Replace a draft reply in the history with its refined version if it changed materially"""
+        if not self.is_material_revision(draft, refined):
+            return False
+        for index in range(len(self.conversation_history) - 1, 0, -1):
+            message = self.conversation_history[index]
+            if message["role"] == "assistant" and message["content"] == draft:
+                self.conversation_history.replace_content(index, refined)
+                return True
+        return False
+
+    def history_bytes(self):
+        """Size of the message contents held in both histories, in bytes"""
+        return sum(
+            len((msg["content"] or "").encode("utf-8"))
+            for msg in self.conversation_history + self.reasoning_history
+        )
+
     def process_input(self, user_input):
         """Process input based on reasoning mode"""
         if self.reasoning_enabled:
             return self.multi_agent_response(user_input)
         else:
             return self.get_response(user_input)
+
+    def _step_prompt(self, step_prompt):
+        """Prompt asking the assistant to carry out one supervisor step"""
+        return f"""The supervisor suggests the follwing action for next step:
+        {step_prompt}
+        Provide a clear and concise response that directly addresses this step.
+        """
         
     def execute_reasoning_step(self, step_prompt):
         """Execute a single reasoning step"""
         # Track conversation history for this step
-        prompt = f"""The supervisor suggests the follwing action for next step:
-        {step_prompt}
-        Provide a clear and concise response that directly addresses this step.
-        """
-        self.add_message_assistant("user", prompt)
-        completion = self.client.chat.completions.create(
-            model=self.assistant_model,
-            messages=self.conversation_history
-        )
-        assistant_response = completion.choices[0].message.content
+        self.add_message_assistant("user", self._step_prompt(step_prompt))
+        assistant_response = self._run_step(self.conversation_history)
         self.add_message_assistant("assistant", assistant_response)
 
         return assistant_response
-        
-    def analyze_input(self, user_input):
-        """Analyze the input to determine the appropriate reasoning approach"""
 
-        supervisor_prompt = f"""Analyze the following input for the Server and determine:
-        1. Is this a question or a conversational statement?
-        2. What type of reasoning steps would be most appropriate?
-        3. What different perspectives should be considered?
-        4. List the suggested initial reasoning steps in order.
-        5. Give extra explanation about the user prompt, inlcuding hat they ar asking exactly, and how it is usually answered. Do not try answering the prompt directly, rather analyze the user prompt carefully and explain how such prompt or quesion is usually answered, and break it into smaller parts.
+    def _run_step(self, messages):
+        """Ask the assistant to answer the last step prompt in messages"""
+        completion = self._complete("execute_reasoning_step", self._model("execute_reasoning_step"), messages)
+        return completion.choices[0].message.content
 
-        Format your response as JSON:
-        {{
-            "is_question": true/false,
-            "complexity": "simple/medium/complex",
-            "reasoning_type": "logical/analytical/creative/etc",
-            "perspectives": ["perspective1", "perspective2", ...],
-            "steps": ["step1", "step2", ...],
-            "explanation": "extra explanation"
-        }}
+    def _step_messages(self, base, graph, index, results):
+        """History seen by one step: the base history, the steps it depends on, then its own prompt"""
+        messages = list(base)
+        for dependency in graph.ancestors(index):
+            messages.append({"role": "user", "content": self._step_prompt(graph.steps[dependency])})
+            messages.append({"role": "assistant", "content": results[dependency]})
+        messages.append({"role": "user", "content": self._step_prompt(graph.steps[index])})
+        return messages
+
+    def _step_started(self, base, graph, index, results):
+        """Announce a step and return the messages it is run with"""
+        self._publish("step_started", index=index + 1, total=len(graph), step=graph.steps[index])
+        return self._step_messages(base, graph, index, results)
 
-        --------------- The Server chat is as follows ---------------
-        {'\n'.join(f'{msg["role"]}: "{msg["content"]}"' for msg in self.conversation_history[1:])}
+    def _step_finished(self, graph, index, results, response):
+        """Keep a step's result and announce it"""
+        results[index] = response
+        self._publish("step_finished", index=index + 1, total=len(graph), response=response)
+
+    def _merge_steps(self, graph, results):
+        """Append every step and its result to the history in plan order, whatever order they finished in"""
+        for index, step in enumerate(graph.steps):
+            self.add_message_assistant("user", self._step_prompt(step))
+            self.add_message_assistant("assistant", results[index])
+        return [results[index] for index in range(len(graph))]
+
+    def execute_plan(self, steps, dependencies=None):
+        """Execute the plan's steps, running the ones that do not depend on each other concurrently"""
+        graph = StepGraph(steps, dependencies)
+        base = list(self.conversation_history)
+        results = {}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, self.max_parallel_steps)) as pool:
+            while len(results) < len(graph):
+                for index in graph.ready(results, running.values()):
+                    running[pool.submit(self._run_step, self._step_started(base, graph, index, results))] = index
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    self._step_finished(graph, running.pop(future), results, future.result())
+
+        return self._merge_steps(graph, results)
+
+    def _analysis_prompt(self, user_input):
+        """Prompt asking the supervisor to plan the reasoning for user_input"""
+        return analysis_instructions + self._analysis_request(user_input)
+
+    def _analysis_request(self, user_input):
+        """The changing part of the planning prompt: the Server chat and the new input"""
+        return f"""--------------- The Server chat is as follows ---------------
+        {self.conversation_history.transcript()}
         
         user: "{user_input}"
         """
         
-        self.add_message_supervisor("user", supervisor_prompt)
-        completion = self.client.beta.chat.completions.parse(
-            model=self.supervisor_model,
-            messages=self.reasoning_history,
+    def analyze_input(self, user_input):
+        """Analyze the input to determine the appropriate reasoning approach"""
+        reused, messages = self._plan_request(user_input)
+        if reused is not None:
+            return reused
+
+        completion = self._complete(
+            "analyze_input",
+            self.supervisor_model,
+            messages,
             response_format=self.SupervisorJSON
         )
+        return self._planned(user_input, completion)
+
+    def _plan_request(self, user_input):
+        """(reused plan, None) when a stored plan fits user_input, else (None, messages of the planning request)"""
+        # The planning prompt is only built, and in the inline layout added to the supervisor's history, when it is sent
+        reused = self._reuse_plan(user_input)
+        if reused is not None:
+            return reused, None
+        return None, self._analysis_messages(user_input)
 
+    def _planned(self, user_input, completion):
+        """The supervisor's plan from its reply, learnt from before it is returned"""
         supervisor_response = completion.choices[0].message
-        
+        self._learn_plan(user_input, supervisor_response)
         return supervisor_response
 
-    def generate_critical_analysis(self):
-        """Generate critical analysis and alternative viewpoints"""
+    def _plan_reusable(self):
+        """Plans are only shared for opening questions, which do not depend on earlier turns"""
+        return self.plan_index is not None and len(self.conversation_history) == 1
 
-        critical_prompt = f"""Ther Server followed your suggested steps and came up with the responses below.
+    def _reuse_plan(self, user_input):
+        """A stored plan for a near-identical opening question, shaped like a supervisor reply"""
+        if not self._plan_reusable():
+            return None
+        plan, similarity = self.plan_index.lookup(user_input)
+        if plan is None:
+            return None
+        parsed = self.SupervisorJSON.model_validate(plan)
+        return ParsedChatCompletionMessage[self.SupervisorJSON](
+            role="assistant",
+            content=parsed.model_dump_json(),
+            parsed=parsed,
+            refusal=None,
+        )
 
-        Critically analyze the response. Provide a detailed analysis of the response, highlighting any logical flaws, assumptions, or missing information. Give actionable insights.
+    def _learn_plan(self, user_input, supervisor_response):
+        """Learn from a fresh supervisor plan, never a reused one: index it for opening questions and train the fast path"""
+        if supervisor_response.refusal or supervisor_response.parsed is None:
+            return
+        if self._plan_reusable():
+            self.plan_index.add(user_input, supervisor_response.parsed.model_dump())
+        if self.fast_path is not None:
+            self.fast_path.learn(user_input, supervisor_response.parsed)
 
-        Your output should be in the followinf JSON format:
-        {{
-            "satisfaction": "high/medium/low",
-            "accuracy": "high/medium/low",
-            "instructions": "detailed analysis and actionable instructions",
-            "failure": true/false
-        }}
+    def _stable_messages(self, instructions, thread, request):
+        """Supervisor request whose system prompt, instructions and earlier exchanges come first, unchanged"""
+        return [self.reasoning_history[0], {"role": "user", "content": instructions}, *thread,
+                {"role": "user", "content": request}]
 
-        You should not acknowledge whether the respose is correct or not, but rather focus on the reasoning process and the clarity of the response.
-        You should rate high in accuracy only if there is no way to challenge the response critically and every aspect is considered!
-        Also only rate high in satisfaction if the response has shown a reasonable thought process, otherwise, if it is not clear how it was reached, rate low in satisfaction.
-        Check the thought process and see if it is logically sound. There should be a thought process.
-        Give exact instructions on how to improve the response and get a better rating on accuracy and satisfaction.
+    def _analysis_messages(self, user_input):
+        """Messages of the planning request"""
+        if self.prompt_layout == "stable":
+            return self._stable_messages(analysis_instructions, [], self._analysis_request(user_input))
+        self.add_message_supervisor("user", self._analysis_prompt(user_input))
+        return self.reasoning_history
 
-        If the server's response is not stil satisfying or accurate after 5 reasoning steps in the chat history, put the failure to true.
-        --------------- The Server chat is as follows ---------------
-        {'\n'.join(f'{msg["role"]}: "{msg["content"]}"' for msg in self.conversation_history[1:])}
-        """
-        
-        self.reasoning_history.pop()
+    def _critique_messages(self):
+        """Messages of the next review request"""
+        if self.prompt_layout == "stable":
+            return self._stable_messages(critique_instructions, self._critique_thread, self._critique_transcript())
+        critical_prompt = self._critical_prompt()
+        # Each prompt replaces the previous one; a reused plan left no planning prompt, only the system prompt
+        if self.reasoning_history[-1]["role"] == "user":
+            self.reasoning_history.pop()
         self.add_message_supervisor("user", critical_prompt)
-        completion = self.client.beta.chat.completions.parse(
-            model=self.supervisor_model,
-            messages=self.reasoning_history,
+        return self.reasoning_history
+
+    def _critique_answered(self, messages, completion):
+        """The parsed review; in the stable layout it is appended to the run's thread, so the next review extends the same prefix"""
+        if self.prompt_layout == "stable":
+            self._critique_thread.extend([messages[-1], {"role": "assistant", "content": completion.choices[0].message.content}])
+        return completion.choices[0].message.parsed
+
+    def _critical_prompt(self):
+        """Prompt asking the supervisor to rate the Server's reasoning so far"""
+        return critique_instructions + self._critique_transcript() + "\n        "
+
+    def _advance_critique_mark(self, end):
+        """Fold the messages up to end into the digest"""
+        for message in self.conversation_history[self._critique_mark:end]:
+            self.critique_digest.add(message)
+        self._critique_mark = max(self._critique_mark, end)
+
+    def _critique_transcript(self):
+        """The part of the Server chat the supervisor is asked to review"""
+        self._critique_round += 1
+        if self.critique_mode != "delta" and self.prompt_layout != "stable":
+            return f"""--------------- The Server chat is as follows ---------------
+        {self.conversation_history.transcript()}"""
+
+        # Only answers given since the last review are sent in full, everything else as one-line notes
+        end = len(self.conversation_history)
+        new = "\n".join(
+            f'{message["role"]}: "{message["content"]}"' if message["role"] == "assistant" else condense(message)
+            for message in self.conversation_history[self._critique_mark:end]
+        )
+        if self.prompt_layout == "stable" and self._critique_round > 1:
+            # Earlier rounds are already in the supervisor's thread, only what changed since is appended
+            transcript = f"""This is review round {self._critique_round}.
+        --------------- New Server responses since your last review ---------------
+        {new}"""
+        else:
+            transcript = f"""This is review round {self._critique_round} for the question: "{self._run_question}"
+        --------------- Summary of the Server chat you already reviewed ---------------
+        {self.critique_digest.text()}
+        --------------- New Server responses since your last review ---------------
+        {new}"""
+        self._advance_critique_mark(end)
+        return transcript
+
+    def generate_critical_analysis(self):
+        """Generate critical analysis and alternative viewpoints"""
+        messages = self._critique_messages()
+        completion = self._complete(
+            "generate_critical_analysis",
+            self._model("generate_critical_analysis"),
+            messages,
             response_format=self.SupervisorRater,
             max_completion_tokens=400
         )
+        return self._critique_answered(messages, completion)
 
-        supervisor_response = completion.choices[0].message.parsed
+    def _synthesis_prompt(self, critical_analysis, steps):
+        """Prompt asking the assistant to refine its answer from the supervisor's review"""
+        return f"""### Reasoning Step {steps}\nI reviewed your responses, here are your instructions:\n"{critical_analysis}"\nRefine your answer based on the review.
 
-        return supervisor_response
+        Ask yourself, am i missing any important information? Are there any logical flaws in my reasoning? Have I considered all relevant perspectives? How can I improve the clarity and depth of my response?
+
+        Format the response in a clear, succinct, and well-structured manner. Do not include unnecessary information. Be succinct and to the point. Keep it as short as possible, only give the required answer!
+        Do not talk bout the supervision process.
+        """
 
     def reasoning_response(self, critical_analysis, steps):
         """Synthesize a final response incorporating all perspectives"""
-        synthesis_prompt = f"""### Reasoning Step {steps}\nI reviewed your responses, here are your instructions:\n"{critical_analysis}"\nRefine your answer based on the review.
+        self.add_message_assistant("user", self._synthesis_prompt(critical_analysis, steps), name="supervisor")
+        completion = self._complete("reasoning_response", self._model("reasoning_response"), self.conversation_history)
+        self.add_message_assistant("assistant", completion.choices[0].message.content)
 
-        Ask yourself, am i missing any important information? Are there any logical flaws in my reasoning? Have I considered all relevant perspectives? How can I improve the clarity and depth of my response?
+    def _publish(self, event, **data):
+        """Report reasoning progress to the registered listener, if any"""
+        if self.on_progress is not None:
+            self.on_progress(event, data)
 
-        Format the response in a clear, succinct, and well-structured manner. Do not include unnecessary information. Be succinct and to the point. Keep it as short as possible, only give the required answer!
-        Do not talk bout the supervision process.
+    def _model(self, phase):
+        """Model for a reasoning phase: the router's pick for this run, or the configured default"""
+        default = self.supervisor_model if phase in ("analyze_input", "generate_critical_analysis") else self.assistant_model
+        return self._phase_models.get(phase, default)
+
+    def _takes_fast_path(self, user_input):
+        """Whether the local router sends this input straight to get_response"""
+        routed, self._routed = self._routed, None
+        if routed is not None and routed[0] == user_input:
+            return routed[1]
+        return self.fast_path is not None and self.fast_path.should_skip(user_input)
+
+    def would_reason(self, user_input):
+        """Whether a reasoning run on user_input would do more than answer it directly
+
+        The fast-path decision is kept for the next run on user_input, so the router counts it once.
         """
+        skips = self._takes_fast_path(user_input)
+        self._routed = (user_input, skips)
+        return not skips and self._session_limit() is None
 
-        self.add_message_assistant("user", synthesis_prompt, name="supervisor")
-        completion = self.client.chat.completions.create(
-            model=self.assistant_model,
-            messages=self.conversation_history
+    def _start_reasoning(self, user_input, analysis):
+        """Seed the assistant's history with the user input and the supervisor's guidance"""
+        if self.model_router is not None:
+            self._phase_models = self.model_router.plan(analysis.parsed.complexity)
+        self._publish(
+            "plan_ready",
+            steps=analysis.parsed.steps,
+            complexity=analysis.parsed.complexity,
+            reasoning_type=analysis.parsed.reasoning_type,
+            perspectives=analysis.parsed.perspectives,
         )
-        assistant_prompt = completion.choices[0].message.content
-        self.add_message_assistant("assistant", assistant_prompt)
+        # Earlier turns reach the supervisor's reviews as digest lines, this run's messages as new ones
+        self._advance_critique_mark(len(self.conversation_history))
+        self._critique_round = 0
+        self._critique_thread = []
+        self._run_question = user_input
+        self.add_message_assistant("user", user_input)
+        self.add_message_assistant("user", f"consider the guidance from the supervisor: {analysis.parsed.explanation}")
+
+    def _critique_settled(self, critical_analysis, steps):
+        """Why the supervisor's critique ends the refinement loop, or None if it does not"""
+        self._publish(
+            "critique",
+            round=steps,
+            satisfaction=critical_analysis.satisfaction,
+            accuracy=critical_analysis.accuracy,
+            failure=critical_analysis.failure,
+        )
+        self._rate_answer(critical_analysis)
+        if critical_analysis.accuracy == "high" and critical_analysis.satisfaction == "high":
+            return "settled"
+        elif critical_analysis.failure:
+            print("Reasoning failed")
+            return "failure"
+        return None
+
+    def _rate_answer(self, critical_analysis):
+        """Keep the reviewed answer if it is rated at least as well as the best one so far"""
+        score = RATINGS.get(str(critical_analysis.accuracy).lower(), 0) + RATINGS.get(str(critical_analysis.satisfaction).lower(), 0)
+        self._last_score = score
+        if self._converging is not None:
+            self._converging.rated(self.conversation_history[-1]["content"], score)
+        if self._best is None or score >= self._best[0]:
+            self._best = (score, self.conversation_history[-1]["content"])
+
+    def _begin_run(self):
+        """Start tracking a reasoning run against the request and session budgets"""
+        self._begin_request("reasoning")
+        self._run = BudgetTracker(self.request_budget, parent=self.session_usage)
+        self._best = None
+        self._last_score = None
+        self._refinements = 0
+        self._converging = self.convergence.track(self.request_budget.max_rounds) if self.convergence else None
+
+    def _converged(self):
+        """"converged" when the latest refinement shows further rounds would not change the answer, else None"""
+        if self._converging is None or not self._converging.refined(self.conversation_history[-1]["content"]):
+            return None
+        return "converged"
+
+    def _budget_exhausted(self, ignore=()):
+        """The request or session limit this run has reached, or None"""
+        limit = self._run.exceeded(ignore)
+        if limit is not None:
+            self._publish("budget_exhausted", limit=limit, **self._run.report())
+        return limit
+
+    def _latest_answer(self):
+        """The newest assistant message of the conversation"""
+        for message in reversed(self.conversation_history):
+            if message["role"] == "assistant":
+                return message["content"]
+        return None
+
+    def _upstream_failed(self, error):
+        """Note an upstream failure that ends the run, dropping any prompt left unanswered"""
+        log.warning("Reasoning stopped by an upstream error, keeping the best answer so far: %s", error)
+        self.metrics.recovered("best_answer")
+        self.last_error = str(error)
+        if self.conversation_history[-1]["role"] != "assistant":
+            self.conversation_history.pop()
+        self._publish("upstream_error", error=str(error))
+        return "upstream_error"
+
+    def _plan_failed(self, error, user_input, seeded):
+        """Answer directly when the plan could not be made or carried out, dropping what the run added to the history"""
+        self._unplanned(error, seeded)
+        return self._finish_run("upstream_error", self.get_response(user_input), direct=True)
+
+    def _unplanned(self, error, seeded):
+        """Note the upstream error that stopped planning and drop what the run added to the history after seeded"""
+        log.warning("Reasoning stopped by an upstream error, answering directly: %s", error)
+        self.metrics.recovered("direct_answer")
+        self.last_error = str(error)
+        del self.conversation_history[seeded:]
+        self._publish("upstream_error", error=str(error))
+
+    def _clear_run(self):
+        """Drop the state of a run that ended by an exception, so later calls inherit neither its deadline nor its request"""
+        if self._run is None:
+            return
+        self.last_run = {"stopped_by": "error", "direct": False, "refinements": self._refinements,
+                         **self._run.report(), "models": self._phase_models}
+        self._run = None
+        self._phase_models = {}
+        self._converging = None
+
+    def _finish_run(self, stopped_by, final_response=None, direct=False, **data):
+        """Record how the run ended and publish it; returns the reply to give the user
+
+        direct marks a run that skipped reasoning and answered like get_response.
+        """
+        if final_response is None:
+            # The latest answer is a refinement of the last reviewed one, so it is kept
+            # unless a budget cut the run short after an earlier answer was rated higher
+            final_response = self._latest_answer()
+            if self._best is not None and self._best[0] > self._last_score:
+                final_response = self._best[1]
+        self.last_run = {"stopped_by": stopped_by, "direct": direct, "refinements": self._refinements,
+                         **self._run.report(), "models": self._phase_models}
+        self._run = None
+        if self.model_router is not None and self._phase_models:
+            self.model_router.run_finished(self._phase_models.values(), self.last_run["rounds"])
+        self._phase_models = {}
+        self.metrics.run_finished(stopped_by, self.last_run["rounds"], self.last_run["elapsed"])
+        if self._converging is not None and self._converging.scores:
+            self._converging.finish()
+        self._converging = None
+        self._publish("done", rounds=self.last_run["rounds"], response=final_response, stopped_by=stopped_by, **data)
+        return final_response
 
     def multi_agent_response(self, user_input):
         """Enhanced reasoning process with critical analysis"""
+        self._begin_run()
+        try:
+            return self._reason(user_input)
+        finally:
+            self._clear_run()
+
+    def _reason(self, user_input):
+        """One reasoning run: plan, steps, then critique and refinement rounds until a stop condition"""
+        limit = self._session_spent(user_input)
+        if limit:
+            return self._finish_run(limit, self._budget_reply(limit), direct=True)
+
+        # Obvious small talk and simple lookups need no supervisor at all
+        if self._takes_fast_path(user_input):
+            return self._finish_run("fast_path", self.get_response(user_input), direct=True, fast_path=True)
+
         # First, analyze the input
-        analysis = self.analyze_input(user_input)
-        
-        if analysis.refusal:
-            # handle refusal
-            return self.get_response(user_input)
-        
+        seeded = len(self.conversation_history)
+        try:
+            analysis = self.analyze_input(user_input)
+        except Exception as e:
+            return self._plan_failed(e, user_input, seeded)
+
+        # A refused plan, or no budget left to carry it out, is answered directly
+        stopped_by = self._plan_stopped(analysis)
+        if stopped_by:
+            return self._finish_run(stopped_by, self.get_response(user_input), direct=True)
+
         # Execute initial reasoning steps
-        responses = []
-        self.add_message_assistant("user", user_input)
-        self.add_message_assistant("user", f"consider the guidance from the supervisor: {analysis.parsed.explanation}")
-        
-        for step in analysis.parsed.steps:
-            step_response = self.execute_reasoning_step(step)
-            responses.append(step_response)
-        
-        # Generate critical analysis from different perspectives
+        self._start_reasoning(user_input, analysis)
+        try:
+            self.execute_plan(analysis.parsed.steps, analysis.parsed.dependencies)
+        except Exception as e:
+            return self._plan_failed(e, user_input, seeded)
 
-        steps = 0
-        # critical_analysis = self.generate_critical_analysis()
-        while True:
-            steps += 1
-            critical_analysis = self.generate_critical_analysis()
-            if critical_analysis.accuracy == "high" and critical_analysis.satisfaction == "high":
-                break
-            elif critical_analysis.failure:
-                print("Reasoning failed")
+        # Generate critical analysis from different perspectives
+        stopped_by = self._budget_exhausted()
+        while stopped_by is None:
+            self._run.add_round()
+            steps = self._run.rounds
+            try:
+                critical_analysis = self.generate_critical_analysis()
+                stopped_by = self._review_stopped(critical_analysis, steps)
+                if stopped_by:
+                    break
+                self.reasoning_response(critical_analysis.instructions, steps)
+            except Exception as e:
+                # An upstream failure that outlived its retries ends the run with the best answer so far
+                stopped_by = self._upstream_failed(e)
                 break
+            stopped_by = self._refined(steps)
+
+        # Generate final response
+        return self._reasoned(stopped_by)
+
+    def _session_spent(self, user_input):
+        """The session limit that stops a run before it starts, with the budget reply added to the history, or None"""
+        limit = self._session_limit()
+        if limit:
+            self.add_message_assistant("user", user_input)
+            self.add_message_assistant("assistant", self._budget_reply(limit))
+        return limit
+
+    def _plan_stopped(self, analysis):
+        """"refusal" or the budget limit that keeps a plan from being carried out, or None"""
+        self.metrics.plan(analysis.refusal)
+        if analysis.refusal:
+            return "refusal"
+        return self._budget_exhausted()
+
+    def _review_stopped(self, critical_analysis, steps):
+        """Why the run stops after a review, or None to refine the answer"""
+        # The refinement of the last allowed review is still made, whatever the round limit
+        stopped_by = self._critique_settled(critical_analysis, steps) or self._budget_exhausted(ignore=("max_rounds",))
+        if not stopped_by:
             print("Step:", steps)
             print("Critical Analysis:", critical_analysis)
-            self.reasoning_response(critical_analysis.instructions, steps)
+        return stopped_by
 
-        print(f"Critical analysis completed in {steps} steps")
-        
-        # Generate final response
-        final_response = self.conversation_history[-1]["content"]
-        
-        return final_response
\ No newline at end of file
+    def _refined(self, steps):
+        """Publish a refinement; returns why the run stops after it, or None for another round"""
+        self._refinements += 1
+        self._publish("refinement", round=steps, response=self.conversation_history[-1]["content"])
+        return self._converged() or self._budget_exhausted()
+
+    def _reasoned(self, stopped_by):
+        """Finish a run that reached its critique rounds, with its best answer"""
+        print(f"Critical analysis completed in {self._run.rounds} steps ({stopped_by})")
+        return self._finish_run(stopped_by)
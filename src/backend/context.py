@@ -0,0 +1,222 @@
+# context.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from backend.tokens import estimate_tokens, message_tokens
+
+# Context windows of the models this project is usually run with, in tokens
+CONTEXT_LIMITS = {
+    "openai/gpt-3.5-turbo": 16385,
+    "openai/gpt-4o": 128000,
+    "openai/gpt-4o-mini": 128000,
+    "anthropic/claude-3.5-haiku": 200000,
+    "anthropic/claude-3.5-sonnet": 200000,
+}
+
+summary_prompt = """Summarize the earlier part of this conversation so it can replace it in the context window.
+Keep every fact, number, decision, open question and instruction that later turns may rely on. Drop pleasantries and repetition.
+Write at most {words} words of plain prose.
+"""
+
+
+def _chain(previous, message):
+    """Extend a rolling hash of a message sequence by one message"""
+    encoded = json.dumps([message.get("role"), message.get("name"), message.get("content")], ensure_ascii=False)
+    return hashlib.sha256((previous + encoded).encode("utf-8")).hexdigest()
+
+
+def truncate_text(text, tokens):
+    """Shorten text to about `tokens` tokens, keeping its beginning and its end"""
+    if estimate_tokens(text) <= tokens:
+        return text
+    keep = max(tokens * 4 // 2, 1)
+    return f"{text[:keep]}\n[... truncated ...]\n{text[-keep:]}"
+
+
+class ContextPlan:
+    """What has to be sent for one request after fitting it to the budget"""
+
+    def __init__(self, window, head, fold, tail, fold_key=None, previous_summary=None, messages=None):
+        self.window = window
+        self.head = head
+        self.fold = fold
+        self.tail = tail
+        self.fold_key = fold_key
+        self.previous_summary = previous_summary
+        self.messages = messages
+
+    @property
+    def needs_summary(self):
+        return self.messages is None
+
+    def summary_request(self):
+        """Messages asking the model to fold the oldest turns into a summary"""
+        lines = []
+        if self.previous_summary:
+            lines.append(f"Summary so far: {self.previous_summary}")
+        for message in self.fold:
+            content = truncate_text(message.get("content") or "", self.window.summary_input_tokens)
+            lines.append(f'{message["role"]}: "{content}"')
+        return [
+            {"role": "system", "content": summary_prompt.format(words=self.window.summary_tokens * 3 // 4)},
+            {"role": "user", "content": "\n".join(lines)},
+        ]
+
+    def with_summary(self, summary):
+        """Final messages once the summary is known; the summary is cached for later turns"""
+        self.window.remember(self.fold_key, summary)
+        return self.window.assemble(self.head, summary, self.tail)
+
+    def without_summary(self):
+        """Final messages when no summary could be made: the folded turns are dropped"""
+        return self.head + self.tail
+
+
+class ContextWindow:
+    """Keeps each request within a per-model token budget
+
+    When a request is over budget the system prompt and the most recent
+    messages are kept, and the oldest turns in between are dropped, truncated or
+    folded into a summary message. Summaries are cached under a rolling hash of
+    the turns they replace, so a later request that still fits with an existing
+    summary reuses it, and a new summary only has to cover the turns added since.
+    """
+
+    def __init__(self, limits=None, default_limit=16000, reserve=1024, strategy="summarize",
+                 target=0.6, summary_tokens=400, summary_input_tokens=600, max_summaries=512):
+        self.limits = {**CONTEXT_LIMITS, **(limits or {})}
+        self.default_limit = default_limit
+        self.reserve = reserve
+        self.strategy = strategy
+        self.target = target
+        self.summary_tokens = summary_tokens
+        self.summary_input_tokens = summary_input_tokens
+        self.max_summaries = max_summaries
+
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"fitted": 0, "dropped_messages": 0, "truncated_messages": 0,
+                      "summaries_made": 0, "summaries_reused": 0}
+
+    def budget(self, model):
+        """Prompt tokens allowed for a model, leaving room for the reply"""
+        return self.limits.get(model, self.default_limit) - self.reserve
+
+    def remember(self, key, summary):
+        """Cache a summary under the rolling hash of the turns it replaces"""
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            self.stats["summaries_made"] += 1
+            while len(self._summaries) > self.max_summaries:
+                self._summaries.popitem(last=False)
+
+    def _cached(self, key):
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+            return summary
+
+    def assemble(self, head, summary, tail):
+        """Head, then the summary of the folded turns, then the recent messages"""
+        note = {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+        return head + [note] + tail
+
+    def plan(self, model, messages):
+        """Work out how to send messages to model within its budget"""
+        counts = getattr(messages, "token_counts", None)
+        if counts is None or len(counts) != len(messages):
+            counts = [message_tokens(message) for message in messages]
+        budget = self.budget(model)
+        if sum(counts) <= budget:
+            return ContextPlan(self, [], [], [], messages=messages)
+
+        with self._lock:
+            self.stats["fitted"] += 1
+        messages = list(messages)
+        start = 1 if messages and messages[0]["role"] == "system" else 0
+        if len(messages) <= start:
+            return ContextPlan(self, [], [], [], messages=messages)
+        head, head_tokens = messages[:start], sum(counts[:start])
+
+        # The newest message is always kept, shortened if it alone is over budget
+        last = messages[-1]
+        last_budget = budget - head_tokens - self.summary_tokens
+        if counts[-1] > last_budget:
+            last = {**last, "content": truncate_text(last.get("content") or "", max(last_budget, 1))}
+            with self._lock:
+                self.stats["truncated_messages"] += 1
+
+        # Reuse the longest cached summary that makes the request fit
+        if self.strategy == "summarize":
+            keys, key = [], ""
+            for message in messages[start:-1]:
+                key = _chain(key, message)
+                keys.append(key)
+            for end in range(len(keys), 0, -1):
+                summary = self._cached(keys[end - 1])
+                if summary is None:
+                    continue
+                tail = messages[start + end:-1] + [last]
+                if head_tokens + estimate_tokens(summary) + sum(counts[start + end:-1]) + message_tokens(last) <= budget:
+                    with self._lock:
+                        self.stats["summaries_reused"] += 1
+                    return ContextPlan(self, head, [], tail, messages=self.assemble(head, summary, tail))
+                break
+
+        # Keep recent messages up to the target share of the budget, fold the rest
+        room = int(budget * self.target) - head_tokens - message_tokens(last)
+        end = len(messages) - 1
+        while end > start and counts[end - 1] <= room:
+            room -= counts[end - 1]
+            end -= 1
+        fold, tail = messages[start:end], messages[end:-1] + [last]
+
+        if self.strategy == "drop" or not fold:
+            with self._lock:
+                self.stats["dropped_messages"] += len(fold)
+            return ContextPlan(self, head, [], tail, messages=head + tail)
+
+        if self.strategy == "truncate":
+            shortened = [{**message, "content": truncate_text(message.get("content") or "", 60)} for message in fold]
+            with self._lock:
+                self.stats["truncated_messages"] += len(fold)
+            return ContextPlan(self, head, [], tail, messages=head + shortened + tail)
+
+        # Summarize on top of the longest cached summary of an older prefix
+        previous, covered = None, 0
+        for end_index in range(len(fold) - 1, 0, -1):
+            previous = self._cached(keys[end_index - 1])
+            if previous is not None:
+                covered = end_index
+                break
+        return ContextPlan(self, head, fold[covered:], tail, fold_key=keys[len(fold) - 1], previous_summary=previous)
+
+    def report(self):
+        with self._lock:
+            return {"strategy": self.strategy, "cached_summaries": len(self._summaries), **self.stats}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_context_window():
+    """The process-wide context window manager, configured from the environment, or None when disabled"""
+    global _shared
+    strategy = os.getenv("CONTEXT_STRATEGY", "summarize")
+    if strategy == "off":
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = ContextWindow(
+                limits=json.loads(os.getenv("CONTEXT_LIMITS", "{}")),
+                default_limit=int(os.getenv("CONTEXT_DEFAULT_LIMIT", 16000)),
+                reserve=int(os.getenv("CONTEXT_RESERVE", 1024)),
+                strategy=strategy,
+            )
+        return _shared
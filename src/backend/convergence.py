@@ -0,0 +1,99 @@
+# convergence.py
+import os
+import threading
+import time
+from collections import Counter
+
+from backend.similarity import text_similarity
+
+
+class RunConvergence:
+    """Convergence state of one reasoning run: the reviewed answers and their ratings"""
+
+    def __init__(self, detector, max_rounds=None):
+        self.detector = detector
+        self.max_rounds = max_rounds
+        self.scores = []
+        self.answer = None
+        self.stable = 0
+        self.started = None
+        self.converged = False
+
+    def rated(self, answer, score):
+        """Note the answer the supervisor just reviewed and its rating"""
+        if self.started is None:
+            self.started = time.monotonic()
+        self.answer = answer
+        self.scores.append(score)
+
+    def refined(self, answer):
+        """Whether the refinement barely changed the reviewed answer while the ratings stopped improving"""
+        similar = self.answer is not None and text_similarity(self.answer, answer) >= self.detector.similarity
+        stalled = len(self.scores) >= 2 and self.scores[-1] <= max(self.scores[:-1])
+        self.stable = self.stable + 1 if similar and stalled else 0
+        self.converged = self.stable >= self.detector.patience
+        return self.converged
+
+    def finish(self):
+        """Count the run, with the rounds and seconds its early stop saved"""
+        rounds = len(self.scores)
+        saved, seconds = 0, 0.0
+        if self.converged and self.max_rounds is not None:
+            saved = max(self.max_rounds - rounds, 0)
+            # Each skipped round would have taken about as long as the rounds that did run
+            seconds = saved * (time.monotonic() - self.started) / max(rounds, 1)
+        self.detector.record(rounds, self.converged, saved, seconds)
+
+
+class ConvergenceDetector:
+    """Ends refinement loops once further rounds stop changing the answer
+
+    A refinement counts as stable when it is at least `similarity` alike to
+    the answer it refines (character n-gram overlap and word edit distance) and the
+    supervisor's latest rating is no better than an earlier one. After
+    `patience` stable refinements in a row the run is considered converged.
+    """
+
+    def __init__(self, similarity=0.9, patience=1):
+        self.similarity = similarity
+        self.patience = patience
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def track(self, max_rounds=None):
+        """Start following one reasoning run"""
+        return RunConvergence(self, max_rounds)
+
+    def record(self, rounds, converged, rounds_saved, seconds_saved):
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["rounds"] += rounds
+            if converged:
+                self.stats["converged"] += 1
+                self.stats["rounds_saved"] += rounds_saved
+                self.stats["seconds_saved"] += seconds_saved
+
+    def report(self):
+        """Runs stopped early and the rounds and latency that saved"""
+        with self._lock:
+            report = {"similarity": self.similarity, "patience": self.patience, **self.stats}
+        report["seconds_saved"] = round(report.get("seconds_saved", 0.0), 3)
+        return report
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_convergence():
+    """The process-wide convergence detector, configured from the environment, or None when disabled"""
+    global _shared
+    if os.getenv("CONVERGENCE", "1") != "1":
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = ConvergenceDetector(
+                similarity=float(os.getenv("CONVERGENCE_SIMILARITY", 0.9)),
+                patience=int(os.getenv("CONVERGENCE_PATIENCE", 1)),
+            )
+        return _shared
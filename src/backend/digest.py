@@ -0,0 +1,55 @@
+# digest.py
+import re
+from collections import deque
+
+
+def condense(message, limit=160):
+    """One short line standing in for a chat message: its role and its opening words"""
+    content = " ".join((message.get("content") or "").split())
+    # Prefer ending on a sentence boundary when there is one early enough
+    sentence = re.match(r"(.{40,}?[.!?])\s", content[:limit + 1])
+    if sentence:
+        content = sentence.group(1)
+    elif len(content) > limit:
+        content = content[:limit].rstrip() + "..."
+    role = message.get("name") or message["role"]
+    return f"{role}: {content}"
+
+
+class ReasoningDigest:
+    """Compact summary of the chat messages the supervisor has already reviewed
+
+    Each message is condensed once, when it falls behind the review mark, so
+    keeping the digest current costs O(new messages). Once over `max_chars` the
+    oldest lines are dropped.
+    """
+
+    def __init__(self, line_chars=160, max_chars=3000):
+        self.line_chars = line_chars
+        self.max_chars = max_chars
+        self.lines = deque()
+        self.size = 0
+        self.omitted = 0
+
+    def add(self, message):
+        """Condense one more reviewed message into the digest"""
+        line = condense(message, self.line_chars)
+        self.lines.append(line)
+        self.size += len(line) + 1
+        while self.size > self.max_chars and len(self.lines) > 1:
+            self.size -= len(self.lines.popleft()) + 1
+            self.omitted += 1
+
+    def text(self):
+        """The digest as prompt text"""
+        lines = list(self.lines)
+        if self.omitted:
+            lines.insert(0, f"({self.omitted} earlier messages omitted)")
+        return "\n".join(lines) or "(nothing yet)"
+
+    def copy(self):
+        copied = ReasoningDigest(self.line_chars, self.max_chars)
+        copied.lines = deque(self.lines)
+        copied.size = self.size
+        copied.omitted = self.omitted
+        return copied
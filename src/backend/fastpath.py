@@ -0,0 +1,182 @@
+# fastpath.py
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+# Small talk that never needs a plan: greetings, thanks, farewells and acknowledgements
+PLEASANTRY = (
+    r"hi|hello|hey|yo|hiya|howdy|good (?:morning|afternoon|evening|night)|thanks?(?: you)?(?: so much| a lot)?|thank you"
+    r"|thx|ty|bye|goodbye|see (?:you|ya)(?: later)?|cya|ok(?:ay)?|cool|great|nice|awesome|sure|yes|no|yep|nope"
+    r"|how are you(?: doing)?(?: today)?|what'?s up|sup"
+)
+# The whole input must be pleasantries, so "nice, who wrote hamlet?" is not small talk
+SMALL_TALK = re.compile(
+    rf"^(?:{PLEASANTRY})(?:[\s,!.]+(?:{PLEASANTRY}|there|again|everyone|all|friend|buddy))*[\s!.?]*$",
+    re.IGNORECASE,
+)
+# Inputs that look like they need actual reasoning: numbers, maths, comparisons and "why/how" questions
+NEEDS_REASONING = re.compile(
+    r"\d|[+*/=<>^%]|\b(why|how (many|much|do|does|can|would|should)|explain|prove|compare|greater|less|larger|smaller"
+    r"|bigger|more than|fewer|difference|calculate|solve|analy[sz]e|implications?|pros and cons|step)\b",
+    re.IGNORECASE,
+)
+
+# Every reasoning run makes at least one planning call and one critique call to the supervisor
+SUPERVISOR_CALLS_PER_RUN = 2
+
+
+def _features(text):
+    """Word, bigram and shape features of an input for the classifier"""
+    words = re.findall(r"[a-z']+", text.lower())
+    features = list(words)
+    features += [f"{a}_{b}" for a, b in zip(words, words[1:])]
+    features.append(f"__len{min(len(words) // 5, 6)}")
+    if "?" in text:
+        features.append("__question_mark")
+    return features
+
+
+def is_direct(parsed):
+    """Label a supervisor plan: inputs rated simple are the ones a direct reply handles"""
+    return str(parsed.get("complexity", "")).lower() == "simple"
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes over input features, trainable one example at a time"""
+
+    labels = ("direct", "reason")
+
+    def __init__(self):
+        self.examples = Counter()
+        self.counts = {label: Counter() for label in self.labels}
+        self.totals = Counter()
+        self.vocabulary = set()
+
+    def learn(self, text, label):
+        """Add one labelled input"""
+        features = _features(text)
+        self.examples[label] += 1
+        self.counts[label].update(features)
+        self.totals[label] += len(features)
+        self.vocabulary.update(features)
+
+    def trained(self, min_examples):
+        """Whether both labels have enough examples to trust a prediction"""
+        return all(self.examples[label] >= min_examples for label in self.labels)
+
+    def probability_direct(self, text):
+        """Posterior probability that the input is best answered directly"""
+        features = _features(text)
+        vocabulary = len(self.vocabulary) + 1
+        total = sum(self.examples.values())
+        scores = {}
+        for label in self.labels:
+            score = math.log(self.examples[label] / total)
+            for feature in features:
+                score += math.log((self.counts[label][feature] + 1) / (self.totals[label] + vocabulary))
+            scores[label] = score
+        top = max(scores.values())
+        weights = {label: math.exp(score - top) for label, score in scores.items()}
+        return weights["direct"] / sum(weights.values())
+
+
+class FastPathRouter:
+    """Decides locally whether a reasoning-mode input can skip the supervisor entirely
+
+    Heuristics catch obvious small talk and obvious reasoning questions; everything
+    else goes to a naive Bayes model trained on logged supervisor plans. An input
+    takes the fast path only when the verdict is "direct" with at least
+    `threshold` confidence.
+    """
+
+    def __init__(self, log_path=None, threshold=0.85, min_examples=20):
+        self.log_path = log_path
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self.model = NaiveBayes()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+        if log_path and os.path.exists(log_path):
+            self._load(log_path)
+
+    def _load(self, path):
+        """Train on every plan logged so far"""
+        with open(path, encoding="utf-8") as log:
+            for line in log:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.model.learn(record["input"], "direct" if is_direct(record["plan"]) else "reason")
+
+    def classify(self, text):
+        """Return (label, confidence, source) for an input"""
+        stripped = text.strip()
+        if NEEDS_REASONING.search(stripped):
+            return "reason", 0.95, "heuristic"
+        if SMALL_TALK.match(stripped):
+            return "direct", 0.99, "heuristic"
+
+        with self._lock:
+            if not self.model.trained(self.min_examples):
+                return "reason", 0.0, "untrained"
+            direct = self.model.probability_direct(stripped)
+        if direct >= 0.5:
+            return "direct", direct, "model"
+        return "reason", 1 - direct, "model"
+
+    def should_skip(self, text):
+        """Whether the input should bypass the supervisor, counting the decision"""
+        label, confidence, source = self.classify(text)
+        skip = label == "direct" and confidence >= self.threshold
+        with self._lock:
+            self.stats["routed"] += 1
+            self.stats[f"source_{source}"] += 1
+            if skip:
+                self.stats["fast_path"] += 1
+                self.stats["supervisor_calls_saved"] += SUPERVISOR_CALLS_PER_RUN
+        return skip
+
+    def learn(self, text, parsed):
+        """Learn from, and log, a plan the supervisor produced for an input"""
+        plan = parsed.model_dump() if hasattr(parsed, "model_dump") else dict(parsed)
+        with self._lock:
+            self.model.learn(text, "direct" if is_direct(plan) else "reason")
+            if self.log_path:
+                os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as log:
+                    log.write(json.dumps({"input": text, "plan": plan}) + "\n")
+
+    def report(self):
+        """Counters and training state"""
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "trained": self.model.trained(self.min_examples),
+                "examples": dict(self.model.examples),
+                **self.stats,
+            }
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_router():
+    """The process-wide router, configured from the environment, or None when disabled"""
+    global _shared
+    if os.getenv("FASTPATH", "1") != "1":
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = FastPathRouter(
+                # Logging keeps raw user inputs on disk, so it is opt-in
+                log_path=os.getenv("FASTPATH_LOG") or None,
+                threshold=float(os.getenv("FASTPATH_THRESHOLD", 0.85)),
+                min_examples=int(os.getenv("FASTPATH_MIN_EXAMPLES", 20)),
+            )
+        return _shared
@@ -0,0 +1,109 @@
+# history.py
+from backend.tokens import message_tokens
+
+
+def render_message(message):
+    """One line of the Server transcript shown to the supervisor"""
+    return f'{message["role"]}: "{message["content"]}"'
+
+
+class History(list):
+    """Chat message list that keeps its rendered transcript and token counts up to date as it grows
+
+    Appending renders and counts only the new message and touches no other
+    string, so it costs O(new message). The transcript is joined from the
+    rendered lines only when it is asked for and kept until the next change, so
+    building a supervisor prompt never re-formats the conversation. Any other
+    in-place change falls back to a full rebuild.
+    """
+
+    def __init__(self, messages=()):
+        super().__init__()
+        self._reset()
+        for message in messages:
+            self.append(message)
+
+    def _reset(self):
+        """Drop every cached rendering and count"""
+        self._lines = []
+        self.token_counts = []
+        self.total_tokens = 0
+        self._transcript = None
+
+    def _rebuild(self):
+        """Recompute the caches after an arbitrary mutation"""
+        messages = list(self)
+        self._reset()
+        for message in messages:
+            self._track(message)
+
+    def _track(self, message):
+        """Render and count one newly appended message"""
+        self._lines.append(render_message(message))
+        self._transcript = None
+        tokens = message_tokens(message)
+        self.token_counts.append(tokens)
+        self.total_tokens += tokens
+
+    def append(self, message):
+        super().append(message)
+        self._track(message)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def __iadd__(self, messages):
+        self.extend(messages)
+        return self
+
+    def pop(self, index=-1):
+        """Remove and return a message; popping the last one keeps the caches incremental"""
+        if index not in (-1, len(self) - 1):
+            message = list.pop(self, index)
+            self._rebuild()
+            return message
+
+        message = list.pop(self)
+        self._lines.pop()
+        self.total_tokens -= self.token_counts.pop()
+        self._transcript = None
+        return message
+
+    def transcript(self):
+        """The chat after the system prompt, one `role: "content"` line per message"""
+        if self._transcript is None:
+            self._transcript = "\n".join(self._lines[1:])
+        return self._transcript
+
+    def replace_content(self, index, content):
+        """Change one message's content and keep the caches consistent"""
+        self[index] = {**self[index], "content": content}
+
+    def copy(self):
+        """Independent copy that keeps the caches instead of rebuilding them"""
+        copied = History()
+        list.extend(copied, self)
+        copied._lines = list(self._lines)
+        copied.token_counts = list(self.token_counts)
+        copied.total_tokens = self.total_tokens
+        copied._transcript = self._transcript
+        return copied
+
+
+def _rebuilding(name):
+    """Wrap a list mutator so the caches are rebuilt after it runs"""
+    method = getattr(list, name)
+
+    def mutate(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._rebuild()
+        return result
+
+    mutate.__name__ = name
+    mutate.__doc__ = method.__doc__
+    return mutate
+
+
+for _name in ("__setitem__", "__delitem__", "insert", "remove", "clear", "sort", "reverse", "__imul__"):
+    setattr(History, _name, _rebuilding(_name))
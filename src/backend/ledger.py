@@ -0,0 +1,206 @@
+# ledger.py
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from backend.pricing import cost, prices
+
+# Column order of the persisted entries, one JSON array per line
+FIELDS = ("time", "session", "request", "mode", "phase", "model",
+          "prompt_tokens", "completion_tokens", "cached_tokens", "cost")
+
+
+def token_counts(completion):
+    """(prompt, completion, cached) tokens of a reply or final stream chunk, or None without usage"""
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0, cached
+
+
+def _open(path, mode):
+    """Open a ledger file, gzip-compressed when its name ends in .gz"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def read_entries(path):
+    """Yield the entries of a persisted ledger as dicts"""
+    with _open(path, "r") as ledger:
+        for line in ledger:
+            if line.strip():
+                yield dict(zip(FIELDS, json.loads(line)))
+
+
+class Usage:
+    """Calls, tokens and cost summed over some set of upstream calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+
+    def add(self, prompt_tokens, completion_tokens, cached_tokens, price):
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        self.cost += price
+
+    def report(self):
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cost": round(self.cost, 6),
+        }
+
+
+class Ledger:
+    """Priced usage of every upstream call, rolled up per request, session, mode and model
+
+    Requests and sessions are kept in memory up to a bound, oldest first out.
+    With a path, every call is also appended to it as a compact JSON array
+    (see FIELDS) for offline aggregation.
+    """
+
+    def __init__(self, path=None, max_requests=1000, max_sessions=1000):
+        self.path = path
+        self.max_requests = max_requests
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self.total = Usage()
+        self.models = defaultdict(Usage)
+        self.modes = defaultdict(Usage)
+        self.mode_requests = defaultdict(int)
+        # request id -> {"session", "mode", "started", "usage"}
+        self.requests = OrderedDict()
+        self.sessions = OrderedDict()
+
+        self._writer = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def record(self, session, request, mode, phase, model, prompt_tokens, completion_tokens, cached_tokens=0):
+        """Price one upstream call and add it to every rollup; returns its cost"""
+        price = cost(model, prompt_tokens, completion_tokens, cached_tokens)
+        counts = (prompt_tokens, completion_tokens, cached_tokens, price)
+        with self._lock:
+            self.total.add(*counts)
+            self.models[model].add(*counts)
+            self.modes[mode].add(*counts)
+
+            entry = self.requests.get(request)
+            if entry is None:
+                entry = self.requests[request] = {"session": session, "mode": mode, "started": time.time(), "usage": Usage()}
+                self.mode_requests[mode] += 1
+                if len(self.requests) > self.max_requests:
+                    self.requests.popitem(last=False)
+            entry["usage"].add(*counts)
+
+            if session not in self.sessions:
+                self.sessions[session] = Usage()
+                if len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(session)
+            self.sessions[session].add(*counts)
+
+            if self.path:
+                self._write([round(time.time(), 3), session, request, mode, phase, model,
+                             prompt_tokens, completion_tokens, cached_tokens, round(price, 8)])
+        return price
+
+    def _write(self, row):
+        # Flushed per call so a crash loses nothing; a call takes far longer than the write
+        if self._writer is None:
+            self._writer = _open(self.path, "a")
+        self._writer.write(json.dumps(row, separators=(",", ":")) + "\n")
+        self._writer.flush()
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def _request_report(self, request, entry):
+        return {"request": request, "session": entry["session"], "mode": entry["mode"],
+                "started": round(entry["started"], 3), **entry["usage"].report()}
+
+    def session_report(self, session):
+        """Totals and requests of one session, or None when it is unknown"""
+        with self._lock:
+            if session not in self.sessions:
+                return None
+            requests = [self._request_report(request, entry)
+                        for request, entry in self.requests.items() if entry["session"] == session]
+            return {"session": session, **self.sessions[session].report(), "requests": requests}
+
+    def report(self, top=10, recent=20):
+        """Totals, cost per request by mode, per model, the most expensive sessions and the latest requests"""
+        with self._lock:
+            modes = {
+                mode: {**usage.report(), "requests": self.mode_requests[mode],
+                       "cost_per_request": round(usage.cost / self.mode_requests[mode], 6)}
+                for mode, usage in self.modes.items()
+            }
+            expensive = sorted(self.sessions.items(), key=lambda item: item[1].cost, reverse=True)[:top]
+            latest = list(self.requests.items())[-recent:]
+            return {
+                "path": self.path,
+                **self.total.report(),
+                "modes": modes,
+                "models": {model: usage.report() for model, usage in self.models.items()},
+                "top_sessions": [{"session": session, **usage.report()} for session, usage in expensive],
+                "recent_requests": [self._request_report(request, entry) for request, entry in reversed(latest)],
+            }
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_ledger():
+    """The process-wide ledger, persisted to LEDGER_PATH unless it is empty"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            # A malformed PRICES entry fails here, when the first chatbot is made, not at the first priced call
+            prices()
+            _shared = Ledger(
+                path=os.getenv("LEDGER_PATH", "data/ledger.jsonl"),
+                max_requests=int(os.getenv("LEDGER_MAX_REQUESTS", 1000)),
+            )
+        return _shared
+
+
+def summarize(path):
+    """Roll up a persisted ledger by mode and model"""
+    totals = {"modes": defaultdict(Usage), "models": defaultdict(Usage)}
+    requests = defaultdict(set)
+    for entry in read_entries(path):
+        counts = (entry["prompt_tokens"], entry["completion_tokens"], entry["cached_tokens"], entry["cost"])
+        totals["modes"][entry["mode"]].add(*counts)
+        totals["models"][entry["model"]].add(*counts)
+        requests[entry["mode"]].add(entry["request"])
+    return {
+        "modes": {mode: {**usage.report(), "requests": len(requests[mode]),
+                         "cost_per_request": round(usage.cost / len(requests[mode]), 6)}
+                  for mode, usage in totals["modes"].items()},
+        "models": {model: usage.report() for model, usage in totals["models"].items()},
+    }
+
+
+if __name__ == "__main__":
+    # python -m backend.ledger data/ledger.jsonl
+    print(json.dumps(summarize(sys.argv[1] if len(sys.argv) > 1 else "data/ledger.jsonl"), indent=2))
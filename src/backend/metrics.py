@@ -0,0 +1,257 @@
+# metrics.py
+import math
+import threading
+import time
+from collections import defaultdict
+
+from backend.ledger import token_counts
+
+# Seconds, from a cached reply to a slow reasoning run
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+TOKEN_BUCKETS = (64, 256, 1024, 4096, 16384, 65536)
+ROUND_BUCKETS = (0, 1, 2, 3, 4, 5, 7, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of samples keyed by label values, in the Prometheus data model"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[self._key(labels)] += amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values]
+
+
+class Gauge(Metric):
+    """A value set directly, or read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), callback=None):
+        super().__init__(name, help, labels)
+        self._values = {}
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        if self.callback is not None:
+            values = [((), self.callback())]
+        else:
+            with self._lock:
+                values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+                                for key, value in values if value is not None]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> [count per bucket, sum, count]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Span:
+    """Times one upstream phase call and records its model, tokens and outcome when it ends"""
+
+    def __init__(self, metrics, phase, model):
+        self.metrics = metrics
+        self.phase = phase
+        self.model = model
+        self.outcome = "ok"
+        self.detached = False
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+
+    def usage(self, completion):
+        """Take the token counts of a reply"""
+        counts = token_counts(completion)
+        if counts is not None:
+            self.input_tokens, self.output_tokens, self.cached_tokens = counts
+        return completion
+
+    def detach(self):
+        """Keep the span open past its with block, for a stream that calls close() once it is consumed"""
+        self.detached = True
+        return self
+
+    def close(self):
+        self.metrics.finish_span(self, time.perf_counter() - self.started)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        if error_type is not None:
+            self.outcome = "error"
+        if error_type is not None or not self.detached:
+            self.close()
+        return False
+
+
+class Metrics:
+    """The application's metrics, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.families = []
+        # Called with every finished span and its duration
+        self.listeners = []
+        labels = ("phase", "model", "outcome")
+        self.phase_seconds = self.add(Histogram(
+            "preasoner_phase_seconds", "Latency of upstream phase calls", labels))
+        self.phase_calls = self.add(Counter(
+            "preasoner_phase_calls_total", "Upstream phase calls by outcome", labels))
+        self.phase_tokens = self.add(Histogram(
+            "preasoner_phase_input_tokens", "Prompt tokens per upstream phase call", ("phase", "model"), TOKEN_BUCKETS))
+        self.tokens = self.add(Counter(
+            "preasoner_tokens_total", "Tokens sent and received; cached counts the sent tokens read from the provider's prompt cache", ("phase", "model", "direction")))
+        self.ttft = self.add(Histogram(
+            "preasoner_ttft_seconds", "Time from a streamed request to its first token", ("phase", "model")))
+        self.run_seconds = self.add(Histogram(
+            "preasoner_reasoning_run_seconds", "Duration of reasoning runs", ("stopped_by",)))
+        self.run_rounds = self.add(Histogram(
+            "preasoner_critique_rounds", "Critique rounds per reasoning run", (), ROUND_BUCKETS))
+        self.runs = self.add(Counter(
+            "preasoner_reasoning_runs_total", "Reasoning runs by what stopped them", ("stopped_by",)))
+        self.recoveries = self.add(Counter(
+            "preasoner_upstream_recoveries_total",
+            "Upstream failures worked around instead of failing the turn, by what was given up", ("fallback",)))
+        self.plans = self.add(Counter(
+            "preasoner_supervisor_plans_total", "Supervisor planning replies, refused or not", ("refused",)))
+        self.add(Gauge(
+            "preasoner_supervisor_refusal_ratio", "Share of planning replies the supervisor refused",
+            callback=self.refusal_ratio))
+
+    def add(self, metric):
+        self.families.append(metric)
+        return metric
+
+    def gauge(self, name, help, callback):
+        """Register a gauge read from callback at every scrape"""
+        return self.add(Gauge(name, help, callback=callback))
+
+    def span(self, phase, model):
+        return Span(self, phase, model)
+
+    def finish_span(self, span, seconds):
+        labels = {"phase": span.phase, "model": span.model, "outcome": span.outcome}
+        self.phase_seconds.observe(seconds, **labels)
+        self.phase_calls.inc(**labels)
+        if span.input_tokens or span.output_tokens:
+            self.phase_tokens.observe(span.input_tokens, phase=span.phase, model=span.model)
+            self.tokens.inc(span.input_tokens, phase=span.phase, model=span.model, direction="input")
+            self.tokens.inc(span.output_tokens, phase=span.phase, model=span.model, direction="output")
+            self.tokens.inc(span.cached_tokens, phase=span.phase, model=span.model, direction="cached")
+        for listener in self.listeners:
+            listener(span, seconds)
+
+    def recovered(self, fallback):
+        """Count an upstream failure worked around: a direct answer, the best answer so far or a dropped summary"""
+        self.recoveries.inc(fallback=fallback)
+
+    def plan(self, refused):
+        self.plans.inc(refused=str(bool(refused)).lower())
+
+    def refusal_ratio(self):
+        refused = self.plans._values.get(("true",), 0)
+        total = refused + self.plans._values.get(("false",), 0)
+        return refused / total if total else None
+
+    def run_finished(self, stopped_by, rounds, seconds):
+        self.runs.inc(stopped_by=stopped_by)
+        self.run_rounds.observe(rounds)
+        self.run_seconds.observe(seconds, stopped_by=stopped_by)
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_metrics():
+    """The process-wide metrics"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Metrics()
+        return _shared
@@ -0,0 +1,131 @@
+# model_router.py
+import json
+import os
+import threading
+from collections import Counter, defaultdict
+
+from backend.pricing import price
+from backend.upstream import shared_upstream
+
+# Phases the router picks a model for, by role; the others use the configured default models
+PHASE_ROLES = {
+    "execute_reasoning_step": "assistant",
+    "reasoning_response": "assistant",
+    "generate_critical_analysis": "supervisor",
+}
+
+# How much of the candidate ladder a phase climbs for each complexity the supervisor reports
+PHASE_DEMAND = {"execute_reasoning_step": 0.5, "reasoning_response": 0.75, "generate_critical_analysis": 1.0}
+COMPLEXITY = {"simple": 0.0, "medium": 0.5, "complex": 1.0}
+
+
+class ModelRouter:
+    """Picks the model of each reasoning phase from a pool of candidates
+
+    Each role's candidates are listed from weakest to strongest. The
+    supervisor's complexity rating sets the weakest candidate a phase may
+    use, so a complex input gets the strongest critic while its steps can
+    still go to a faster model. Among the allowed candidates the one with
+    the lowest expected cost of a run wins: its live p50 latency in the
+    phase, inflated by its upstream error rate, times the critique rounds
+    its runs took to converge, plus its price weighted by cost_weight.
+    Candidates with fewer than min_samples latencies are tried first.
+    """
+
+    def __init__(self, pool, upstream=None, cost_weight=0.1, min_samples=5, error_penalty=4.0):
+        unknown = set(pool) - set(PHASE_ROLES.values())
+        if unknown:
+            raise ValueError(f"MODEL_POOL roles must be among {sorted(set(PHASE_ROLES.values()))}, got {sorted(unknown)}")
+        self.pool = {role: list(models) for role, models in pool.items() if models}
+        self.upstream = upstream
+        self.cost_weight = cost_weight
+        self.min_samples = min_samples
+        self.error_penalty = error_penalty
+        self._lock = threading.Lock()
+        # model -> [runs, rounds] of reasoning runs it took part in
+        self._rounds = defaultdict(lambda: [0, 0])
+        self.picks = Counter()
+
+    def candidates(self, phase, complexity):
+        """Models a phase may use for an input of the given complexity"""
+        models = self.pool.get(PHASE_ROLES.get(phase), [])
+        if not models:
+            return []
+        demand = PHASE_DEMAND.get(phase, 1.0) * COMPLEXITY.get(str(complexity).lower(), 0.5)
+        return models[int(demand * (len(models) - 1)):]
+
+    def mean_rounds(self, model):
+        with self._lock:
+            runs, rounds = self._rounds.get(model, (0, 0))
+        return rounds / runs if runs else None
+
+    def score(self, phase, model):
+        """Expected seconds of a run on model, price included; lower is better"""
+        _, p50, error_rate = self.upstream.health(phase, model)
+        rounds = max(self.mean_rounds(model) or 1.0, 1.0)
+        prompt_price, completion_price, _ = price(model)
+        return ((p50 or 0.0) * (1 + self.error_penalty * error_rate) + self.cost_weight * (prompt_price + completion_price)) * rounds
+
+    def choose(self, phase, complexity):
+        """The model for phase, or None when the phase is not routed"""
+        models = self.candidates(phase, complexity)
+        if not models:
+            return None
+        samples = {model: self.upstream.health(phase, model)[0] for model in models}
+        untried = [model for model in models if samples[model] < self.min_samples]
+        if untried:
+            model = min(untried, key=lambda model: samples[model])
+        else:
+            model = min(models, key=lambda model: self.score(phase, model))
+        with self._lock:
+            self.picks[f"{phase} {model}"] += 1
+        return model
+
+    def plan(self, complexity):
+        """Phase -> model for one reasoning run"""
+        chosen = {phase: self.choose(phase, complexity) for phase in PHASE_ROLES}
+        return {phase: model for phase, model in chosen.items() if model is not None}
+
+    def run_finished(self, models, rounds):
+        """Credit the critique rounds of a finished run to every model it used"""
+        with self._lock:
+            for model in set(models):
+                self._rounds[model][0] += 1
+                self._rounds[model][1] += rounds
+
+    def report(self):
+        models = {}
+        for role, pool in self.pool.items():
+            phases = [phase for phase, phase_role in PHASE_ROLES.items() if phase_role == role]
+            models[role] = {}
+            for model in pool:
+                health = {phase: self.upstream.health(phase, model) for phase in phases}
+                models[role][model] = {
+                    "mean_rounds": self.mean_rounds(model),
+                    "error_rate": round(next(iter(health.values()), (0, None, 0.0))[2], 4),
+                    "p50_ms": {phase: round(p50 * 1000) for phase, (_, p50, _) in health.items() if p50 is not None},
+                }
+        with self._lock:
+            picks = dict(self.picks)
+        return {"pool": self.pool, "cost_weight": self.cost_weight, "models": models, "picks": picks}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_model_router():
+    """The process-wide model router when MODEL_POOL lists candidates, otherwise None"""
+    global _shared
+    pool = json.loads(os.getenv("MODEL_POOL", "{}") or "{}")
+    if not any(pool.values()):
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = ModelRouter(
+                pool,
+                upstream=shared_upstream(),
+                cost_weight=float(os.getenv("ROUTER_COST_WEIGHT", 0.1)),
+                min_samples=int(os.getenv("ROUTER_MIN_SAMPLES", 5)),
+            )
+        return _shared
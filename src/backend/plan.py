@@ -0,0 +1,57 @@
+# plan.py
+
+
+class StepGraph:
+    """Dependency graph over the steps of a supervisor plan
+
+    dependencies[i] lists the 1-based numbers of the earlier steps that step i+1
+    needs. Only references to earlier steps are kept, so the graph is always
+    acyclic. A missing or malformed dependency list falls back to running the
+    steps one after the other, as the plan was executed before.
+    """
+
+    def __init__(self, steps, dependencies=None):
+        self.steps = list(steps)
+        self.dependencies = self._normalize(dependencies)
+
+    def _normalize(self, dependencies):
+        """Turn the supervisor's 1-based dependency lists into sets of 0-based indices"""
+        count = len(self.steps)
+        if not dependencies or len(dependencies) != count:
+            return [{index - 1} if index else set() for index in range(count)]
+
+        normalized = []
+        for index, needs in enumerate(dependencies):
+            normalized.append({
+                number - 1 for number in needs
+                if isinstance(number, int) and 1 <= number <= index
+            })
+        return normalized
+
+    def __len__(self):
+        return len(self.steps)
+
+    def ready(self, finished, started):
+        """Indices whose dependencies have all finished and which have not started yet"""
+        return [
+            index for index in range(len(self.steps))
+            if index not in started and index not in finished and self.dependencies[index] <= finished.keys()
+        ]
+
+    def ancestors(self, index):
+        """All steps that index depends on, directly or transitively, in plan order"""
+        seen = set()
+        stack = list(self.dependencies[index])
+        while stack:
+            current = stack.pop()
+            if current not in seen:
+                seen.add(current)
+                stack.extend(self.dependencies[current])
+        return sorted(seen)
+
+    def critical_path(self):
+        """Number of steps on the longest dependency chain"""
+        depth = []
+        for index in range(len(self.steps)):
+            depth.append(1 + max((depth[d] for d in self.dependencies[index]), default=0))
+        return max(depth, default=0)
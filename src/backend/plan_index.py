@@ -0,0 +1,153 @@
+# plan_index.py
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+
+from backend.similarity import char_ngrams, ngram_similarity, normalize
+
+# Mersenne prime used by the MinHash permutations
+_PRIME = (1 << 61) - 1
+
+
+def numbers(text):
+    """The normalized words of text that carry digits, in order"""
+    return tuple(word for word in normalize(text).split() if any(char.isdigit() for char in word))
+
+
+def _gram_hash(gram):
+    """Stable 64-bit hash of an n-gram, identical across processes"""
+    return int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class MinHasher:
+    """MinHash signatures of character n-gram sets"""
+
+    def __init__(self, num_perm=64, ngram=3, seed=7):
+        self.ngram = ngram
+        generator = random.Random(seed)
+        self.permutations = [
+            (generator.randrange(1, _PRIME), generator.randrange(0, _PRIME)) for _ in range(num_perm)
+        ]
+
+    def signature(self, text):
+        """One minimum per permutation over the text's n-grams"""
+        hashes = [_gram_hash(gram) for gram in char_ngrams(text, self.ngram)] or [0]
+        return tuple(min((a * value + b) % _PRIME for value in hashes) for a, b in self.permutations)
+
+
+class PlanIndex:
+    """Near-duplicate index from past user inputs to the supervisor plans made for them
+
+    Candidates come from MinHash LSH buckets and are confirmed with the exact
+    n-gram Jaccard similarity, so a stored plan is only reused for inputs at
+    least `threshold` similar to the one it was made for and quoting the
+    same numbers, since a plan's steps and explanation repeat them. Entries are kept in
+    a SQLite file and re-indexed on start-up. Inputs that normalize to the same
+    text share one entry, which keeps the newest plan, so a frequent question
+    does not grow the index or its buckets.
+    """
+
+    def __init__(self, path=None, threshold=0.8, num_perm=64, bands=16):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm=num_perm)
+
+        self._entries = []
+        # normalized input -> position of its entry
+        self._positions = {}
+        self._buckets = defaultdict(list)
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS plans (input TEXT PRIMARY KEY, plan TEXT NOT NULL)")
+            self._db.commit()
+            for text, plan in self._db.execute("SELECT input, plan FROM plans"):
+                self._insert(text, json.loads(plan))
+
+    def _band_keys(self, signature):
+        """LSH bucket keys, one per band of the signature"""
+        return [(band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def _insert(self, text, plan):
+        """Add an entry to the in-memory index, or replace the plan of the entry for the same input
+
+        Returns the input text the entry is stored under.
+        """
+        normalized = normalize(text)
+        position = self._positions.get(normalized)
+        if position is not None:
+            text = self._entries[position][0]
+            self._entries[position] = (text, plan)
+            return text
+
+        position = len(self._entries)
+        self._positions[normalized] = position
+        self._entries.append((text, plan))
+        for key in self._band_keys(self.hasher.signature(text)):
+            self._buckets[key].append(position)
+        return text
+
+    def lookup(self, text):
+        """Return (plan, similarity) of the closest stored input above the threshold, or (None, best)"""
+        signature = self.hasher.signature(text)
+        quoted = numbers(text)
+        with self._lock:
+            candidates = {position for key in self._band_keys(signature) for position in self._buckets.get(key, ())}
+            best, best_similarity = None, 0.0
+            for position in candidates:
+                stored_text, plan = self._entries[position]
+                similarity = ngram_similarity(text, stored_text)
+                if similarity <= best_similarity:
+                    continue
+                # The same question about other numbers needs its own plan
+                if numbers(stored_text) != quoted:
+                    self.stats["number_mismatches"] += 1
+                    continue
+                best, best_similarity = plan, similarity
+
+            if best is not None and best_similarity >= self.threshold:
+                self.stats["hits"] += 1
+                return best, best_similarity
+            self.stats["misses"] += 1
+            return None, best_similarity
+
+    def add(self, text, plan):
+        """Store the plan made for an input"""
+        with self._lock:
+            text = self._insert(text, plan)
+            self.stats["stored"] += 1
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO plans (input, plan) VALUES (?, ?)", (text, json.dumps(plan)))
+                self._db.commit()
+
+    def report(self):
+        """Hit/miss counters and index size"""
+        with self._lock:
+            return {"threshold": self.threshold, "entries": len(self._entries), **self.stats}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_plan_index():
+    """The process-wide plan index, configured from the environment, or None when disabled"""
+    global _shared
+    if os.getenv("PLAN_REUSE", "1") != "1":
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = PlanIndex(
+                path=os.getenv("PLAN_INDEX_PATH", "data/plan_index.sqlite3") or None,
+                threshold=float(os.getenv("PLAN_REUSE_THRESHOLD", 0.8)),
+            )
+        return _shared
@@ -0,0 +1,50 @@
+# pricing.py
+import json
+import os
+
+# USD per million tokens: (prompt, completion, cached prompt), as listed on OpenRouter
+PRICES = {
+    "openai/gpt-3.5-turbo": (0.5, 1.5, 0.5),
+    "openai/gpt-4o": (2.5, 10.0, 1.25),
+    "openai/gpt-4o-mini": (0.15, 0.6, 0.075),
+    "anthropic/claude-3.5-haiku": (0.8, 4.0, 0.08),
+    "anthropic/claude-3.5-sonnet": (3.0, 15.0, 0.3),
+}
+
+
+def load_prices():
+    """Built-in prices overridden by PRICES, a JSON object of model -> [prompt, completion, cached]
+
+    The cached price may be left out, cached prompt tokens then cost as much as the others.
+    Raises ValueError naming the model of an entry that is not two or three numbers.
+    """
+    prices = dict(PRICES)
+    for model, listed in json.loads(os.getenv("PRICES", "{}")).items():
+        if not isinstance(listed, list) or len(listed) not in (2, 3) \
+                or not all(isinstance(value, (int, float)) for value in listed):
+            raise ValueError(f"PRICES entry for {model} must be [prompt, completion] or [prompt, completion, cached], got {listed!r}")
+        prices[model] = tuple(listed) if len(listed) == 3 else (listed[0], listed[1], listed[0])
+    return prices
+
+
+_prices = None
+
+
+def prices():
+    """The price table, loaded from the environment on first use"""
+    global _prices
+    if _prices is None:
+        _prices = load_prices()
+    return _prices
+
+
+def price(model):
+    """(prompt, completion, cached) dollars per million tokens; models without a price cost nothing"""
+    return prices().get(model, (0.0, 0.0, 0.0))
+
+
+def cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """Dollar cost of one call; cached_tokens are the part of prompt_tokens read from the provider's cache"""
+    prompt_price, completion_price, cached_price = price(model)
+    return ((prompt_tokens - cached_tokens) * prompt_price + cached_tokens * cached_price
+            + completion_tokens * completion_price) / 1_000_000
@@ -0,0 +1,94 @@
+# prompt_layout.py
+import os
+import threading
+from collections import defaultdict
+
+from backend.metrics import shared_metrics
+
+# Models whose provider only caches prompts at explicit cache_control breakpoints;
+# OpenAI-style providers cache any long repeated prefix on their own
+CACHE_HINT_MODELS = ("anthropic/", "google/gemini")
+
+
+def hint_models():
+    value = os.getenv("CACHE_HINT_MODELS")
+    if value is None:
+        return CACHE_HINT_MODELS
+    return tuple(prefix.strip() for prefix in value.split(",") if prefix.strip())
+
+
+def _hinted(message):
+    """A copy of message whose last content block carries a cache breakpoint"""
+    content = message["content"]
+    blocks = [{"type": "text", "text": content}] if isinstance(content, str) else [dict(block) for block in content]
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return {**message, "content": blocks}
+
+
+def cache_hints(model, messages):
+    """messages with cache breakpoints for providers that need them, unchanged for the others
+
+    The first two messages hold the static system prompt and phase
+    instructions, and the last one ends the prefix the next call of an
+    append-only conversation will repeat, so those three are marked.
+    """
+    if not model.startswith(hint_models()) or not messages:
+        return messages
+    marked = {0, 1, len(messages) - 1}
+    return [_hinted(message) if index in marked and message.get("content") else message
+            for index, message in enumerate(messages)]
+
+
+class PromptCacheStats:
+    """Prompt and cached tokens per phase, and latency with and without a provider cache hit"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # phase -> counters
+        self._phases = defaultdict(lambda: {"calls": 0, "hits": 0, "prompt_tokens": 0, "cached_tokens": 0,
+                                            "hit_seconds": 0.0, "miss_seconds": 0.0})
+
+    def observe(self, span, seconds):
+        """Metrics listener: count one finished upstream call that reported its usage"""
+        if span.outcome != "ok" or not span.input_tokens:
+            return
+        with self._lock:
+            phase = self._phases[span.phase]
+            phase["calls"] += 1
+            phase["prompt_tokens"] += span.input_tokens
+            phase["cached_tokens"] += span.cached_tokens
+            if span.cached_tokens:
+                phase["hits"] += 1
+                phase["hit_seconds"] += seconds
+            else:
+                phase["miss_seconds"] += seconds
+
+    def report(self):
+        with self._lock:
+            phases = {}
+            for name, phase in self._phases.items():
+                misses = phase["calls"] - phase["hits"]
+                phases[name] = {
+                    "calls": phase["calls"],
+                    "hits": phase["hits"],
+                    "prompt_tokens": phase["prompt_tokens"],
+                    "cached_tokens": phase["cached_tokens"],
+                    "cached_share": round(phase["cached_tokens"] / phase["prompt_tokens"], 3),
+                    "hit_ms": round(phase["hit_seconds"] / phase["hits"] * 1000) if phase["hits"] else None,
+                    "miss_ms": round(phase["miss_seconds"] / misses * 1000) if misses else None,
+                }
+        return {"layout": os.getenv("PROMPT_LAYOUT", "inline"), "hint_models": list(hint_models()), "phases": phases}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_prompt_cache():
+    """The process-wide prompt cache statistics, fed by every upstream span"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = PromptCacheStats()
+            shared_metrics().listeners.append(_shared.observe)
+        return _shared
@@ -0,0 +1,280 @@
+# ratelimit.py
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+from backend.metrics import Counter, Histogram, shared_metrics
+from backend.transport import shared_transport
+
+# Tokens a request is assumed to generate when it sets no max_completion_tokens
+COMPLETION_ESTIMATE = 512
+
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def parse_reset(value):
+    """Seconds until a rate limit resets, from "20ms", "1.5s", "6m0s", plain seconds or an epoch timestamp"""
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+        if not parts:
+            return None
+        units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(amount) * units[unit] for amount, unit in parts)
+    if number > 1e12:
+        return max(number / 1000 - time.time(), 0.0)
+    if number > 1e9:
+        return max(number - time.time(), 0.0)
+    return number
+
+
+def _header_number(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+class RateLimitWait(Exception):
+    """A call that would have to wait for its model's rate limit longer than its caller can"""
+
+    def __init__(self, model, wait):
+        super().__init__(f"rate limit of {model} needs a {wait:.1f}s wait")
+        self.model = model
+        self.wait = wait
+
+
+class Bucket:
+    """A token bucket that may go into debt, so waiting callers are served in the order they arrived"""
+
+    def __init__(self, capacity):
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def take(self, amount, rate, capacity, now):
+        """Take amount and return the seconds to wait until it is covered at rate per second"""
+        self.level = min(capacity, self.level + rate * (now - self.updated))
+        self.updated = now
+        self.level -= amount
+        return max(-self.level / rate, 0.0)
+
+
+class RateLimiter:
+    """Per-model token buckets for requests and tokens per minute, shared by every session
+
+    Callers reserve a request and their estimated tokens from both buckets of
+    their model and wait until they are covered, so a burst is queued instead
+    of being rejected upstream. Buckets hold `burst` seconds worth of their
+    rate. Estimates are corrected with the usage each reply reports.
+
+    Rates adapt to the provider: a 429 halves the model's rates (down to
+    min_scale) and pauses it until the reset the reply names, and every
+    success wins back `recovery` of the configured rates. Limits reported
+    in x-ratelimit headers are adopted for models without a configured one,
+    and a model whose remaining quota reaches zero pauses until its reset.
+    """
+
+    def __init__(self, limits=None, token_limits=None, burst=5.0, min_scale=0.1, recovery=0.05):
+        # model -> requests and tokens per minute; models without a limit are not held back
+        self.limits = dict(limits or {})
+        self.token_limits = dict(token_limits or {})
+        self.burst = burst
+        self.min_scale = min_scale
+        self.recovery = recovery
+        self._scale = defaultdict(lambda: 1.0)
+        self._blocked_until = defaultdict(float)
+        self._backed_off_until = defaultdict(float)
+        self._requests = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"waits": 0, "waited": 0.0, "max_wait": 0.0, "throttled": 0, "refused": 0})
+
+        metrics = shared_metrics()
+        self._wait_seconds = metrics.add(Histogram(
+            "preasoner_rate_limit_wait_seconds", "Time upstream calls waited for their model's rate limit",
+            ("model",), WAIT_BUCKETS))
+        self._throttled = metrics.add(Counter(
+            "preasoner_rate_limited_total", "429 replies per model", ("model",)))
+
+    def set_limit(self, model, per_minute):
+        with self._lock:
+            self.limits[model] = per_minute
+
+    def set_token_limit(self, model, per_minute):
+        with self._lock:
+            self.token_limits[model] = per_minute
+
+    def _take(self, buckets, model, per_minute, amount, now):
+        """Seconds until amount is covered by one of the model's buckets, 0 without a limit"""
+        if not per_minute or not amount:
+            return 0.0
+        rate = per_minute * self._scale[model] / 60.0
+        capacity = max(rate * self.burst, 1.0)
+        if model not in buckets:
+            buckets[model] = Bucket(capacity)
+        return buckets[model].take(amount, rate, capacity, now)
+
+    def _reserve(self, model, tokens=0, max_wait=None):
+        """Seconds to wait before a request of about tokens tokens may go to model; the capacity is taken
+
+        Raises RateLimitWait, taking nothing, when the wait would be longer than max_wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(
+                self._take(self._requests, model, self.limits.get(model), 1, now),
+                self._take(self._tokens, model, self.token_limits.get(model), tokens, now),
+                self._blocked_until[model] - now,
+            )
+            stats = self._stats[model]
+            refused = max_wait is not None and wait > max_wait
+            if refused:
+                self._refund(self._requests, model, self.limits.get(model), 1)
+                self._refund(self._tokens, model, self.token_limits.get(model), tokens)
+                stats["refused"] += 1
+            elif wait > 0:
+                stats["waits"] += 1
+                stats["waited"] += wait
+                stats["max_wait"] = max(stats["max_wait"], wait)
+        if refused:
+            raise RateLimitWait(model, wait)
+        if wait > 0:
+            self._wait_seconds.observe(wait, model=model)
+        return wait
+
+    @staticmethod
+    def _refund(buckets, model, per_minute, amount):
+        if per_minute and amount and model in buckets:
+            buckets[model].level += amount
+
+    def acquire(self, model, tokens=0, max_wait=None):
+        """Block until a request to model may be sent; raises RateLimitWait rather than wait past max_wait"""
+        wait = self._reserve(model, tokens, max_wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, model, tokens=0, max_wait=None):
+        """Wait, without blocking the event loop, until a request to model may be sent"""
+        wait = self._reserve(model, tokens, max_wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def try_acquire(self, model, tokens=0):
+        """Take capacity for a request to model only if it may be sent right away"""
+        try:
+            self._reserve(model, tokens, max_wait=0)
+        except RateLimitWait:
+            return False
+        return True
+
+    def succeeded(self, model, estimated=0, completion=None):
+        """Credit back an over-estimate with the reply's usage and recover some of a throttled rate"""
+        usage = getattr(completion, "usage", None)
+        with self._lock:
+            if usage is not None and estimated and model in self._tokens:
+                used = (usage.prompt_tokens or 0) + (usage.completion_tokens or 0)
+                self._tokens[model].level += estimated - used
+            if self._scale[model] < 1.0:
+                self._scale[model] = min(self._scale[model] + self.recovery, 1.0)
+
+    def failed(self, model, error):
+        """Back off a model after a 429 and pause it until the limit resets"""
+        if getattr(error, "status_code", None) != 429:
+            return
+        response = getattr(error, "response", None)
+        headers = response.headers if response is not None else {}
+        pause = parse_reset(headers.get("retry-after")) or self._reset(headers) or 1.0
+        with self._lock:
+            now = time.monotonic()
+            # Requests in flight when the limit was hit fail together; back off once for all of them
+            if now >= self._backed_off_until[model]:
+                self._scale[model] = max(self._scale[model] / 2, self.min_scale)
+                self._backed_off_until[model] = now + pause
+            self._blocked_until[model] = max(self._blocked_until[model], now + pause)
+            self._stats[model]["throttled"] += 1
+        self._throttled.inc(model=model)
+
+    @staticmethod
+    def _reset(headers):
+        return parse_reset(headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset"))
+
+    def observe(self, model, headers):
+        """Learn from the x-ratelimit headers of any reply: limits, and a pause when the quota is used up"""
+        limit = _header_number(headers, "x-ratelimit-limit-requests", "x-ratelimit-limit")
+        token_limit = _header_number(headers, "x-ratelimit-limit-tokens")
+        remaining = _header_number(headers, "x-ratelimit-remaining-requests", "x-ratelimit-remaining")
+        remaining_tokens = _header_number(headers, "x-ratelimit-remaining-tokens")
+        with self._lock:
+            # Reported limits are per minute; an explicitly configured limit always wins
+            if limit and model not in self.limits:
+                self.limits[model] = limit
+            if token_limit and model not in self.token_limits:
+                self.token_limits[model] = token_limit
+            pause = None
+            if remaining is not None and remaining <= 0:
+                pause = self._reset(headers)
+            elif remaining_tokens is not None and remaining_tokens <= 0:
+                pause = parse_reset(headers.get("x-ratelimit-reset-tokens"))
+            if pause:
+                self._blocked_until[model] = max(self._blocked_until[model], time.monotonic() + pause)
+
+    def observe_response(self, request, response):
+        """Transport listener: observe the rate-limit headers of a reply, keyed by the model the request named"""
+        if not any(name.startswith("x-ratelimit-") for name in response.headers):
+            return
+        try:
+            model = json.loads(request.content).get("model")
+        except (ValueError, AttributeError):
+            return
+        if model:
+            self.observe(model, response.headers)
+
+    def report(self):
+        with self._lock:
+            now = time.monotonic()
+            models = set(self.limits) | set(self.token_limits) | set(self._stats)
+            return {
+                model: {
+                    "requests_per_minute": self.limits.get(model),
+                    "tokens_per_minute": self.token_limits.get(model),
+                    "scale": round(self._scale[model], 3),
+                    "paused_for": round(max(self._blocked_until[model] - now, 0.0), 3),
+                    "waits": self._stats[model]["waits"],
+                    "mean_wait": round(self._stats[model]["waited"] / self._stats[model]["waits"], 3)
+                    if self._stats[model]["waits"] else 0.0,
+                    "max_wait": round(self._stats[model]["max_wait"], 3),
+                    "throttled": self._stats[model]["throttled"],
+                    "refused": self._stats[model]["refused"],
+                }
+                for model in sorted(models)
+            }
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter():
+    """The process-wide rate limiter, e.g. RATE_LIMITS={"openai/gpt-4o": 60} TOKEN_LIMITS={"openai/gpt-4o": 30000}"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = RateLimiter(
+                json.loads(os.getenv("RATE_LIMITS", "{}")),
+                json.loads(os.getenv("TOKEN_LIMITS", "{}")),
+                burst=float(os.getenv("RATE_LIMIT_BURST", 5)),
+            )
+            shared_transport().listeners.append(_shared.observe_response)
+        return _shared
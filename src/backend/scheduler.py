@@ -0,0 +1,227 @@
+# scheduler.py
+import asyncio
+import threading
+import time
+import traceback
+from collections import Counter, OrderedDict, deque
+
+from backend.metrics import Counter as MetricCounter, Histogram, shared_metrics
+
+# Lanes in priority order
+LANES = ("standard", "reasoning")
+
+
+class Busy(Exception):
+    """A job refused because the scheduler or the client is over capacity"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Job:
+    """One queued chat turn: a coroutine function run once a worker slot is free"""
+
+    def __init__(self, client, lane, run, on_position=None, on_shed=None, on_error=None):
+        self.client = client
+        self.lane = lane
+        self.run = run
+        self.on_position = on_position
+        self.on_shed = on_shed
+        self.on_error = on_error
+        self.enqueued = time.monotonic()
+        self.position = None
+
+
+class Scheduler:
+    """Admission control and fair, priority-aware dispatch of chat jobs on an event loop
+
+    At most `workers` jobs run at once and `client_running` per client. Waiting
+    jobs sit in two lanes: standard replies are dispatched before reasoning
+    jobs, except that a reasoning job goes after `standard_burst` standard
+    ones in a row so it is never starved. Within a lane clients take turns,
+    so one client's backlog cannot hold up the others. A job is refused with
+    Busy when `max_queue` jobs already wait or its client has `client_queue`
+    waiting, and dropped once it has waited `max_wait` seconds, whether or not
+    it could have started. A job that raises is reported through its on_error.
+
+    submit() must be called on the event loop's thread.
+    """
+
+    def __init__(self, workers=32, max_queue=256, client_queue=4, client_running=2, standard_burst=4, max_wait=120.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.client_queue = client_queue
+        self.client_running = client_running
+        self.standard_burst = standard_burst
+        self.max_wait = max_wait
+
+        # lane -> client -> waiting jobs; clients are served in insertion order, then moved to the back
+        self._lanes = {lane: OrderedDict() for lane in LANES}
+        self._running = Counter()
+        self._burst = 0
+        self._expiry = None
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+        metrics = shared_metrics()
+        self._waits = metrics.add(Histogram(
+            "preasoner_queue_wait_seconds", "Time chat jobs waited for a worker", ("lane",)))
+        self._shed = metrics.add(MetricCounter(
+            "preasoner_jobs_shed_total", "Chat jobs refused or dropped for lack of capacity", ("reason",)))
+        metrics.gauge("preasoner_jobs_queued", "Chat jobs waiting for a worker", self.queued)
+        metrics.gauge("preasoner_jobs_running", "Chat jobs running", self.running)
+
+    def queued(self, client=None):
+        with self._lock:
+            return sum(len(jobs) for lane in self._lanes.values()
+                       for key, jobs in lane.items() if client is None or key == client)
+
+    def running(self):
+        with self._lock:
+            return sum(self._running.values())
+
+    def submit(self, client, lane, run, on_position=None, on_shed=None, on_error=None):
+        """Queue run() for client in a lane and dispatch what can start; raises Busy when over capacity"""
+        if self.queued() >= self.max_queue:
+            self._refuse("queue_full")
+        if self.queued(client) >= self.client_queue:
+            self._refuse("client_queue_full")
+        job = Job(client, lane, run, on_position, on_shed, on_error)
+        with self._lock:
+            self._lanes[lane].setdefault(client, deque()).append(job)
+            self.stats["submitted"] += 1
+        self._pump()
+        return job
+
+    def _refuse(self, reason):
+        with self._lock:
+            self.stats[f"shed_{reason}"] += 1
+        self._shed.inc(reason=reason)
+        raise Busy(reason)
+
+    def _take(self, lane):
+        """The next job of a lane whose client may start another one, rotating that client to the back"""
+        clients = self._lanes[lane]
+        for client in list(clients):
+            if self._running[client] >= self.client_running:
+                continue
+            jobs = clients.pop(client)
+            job = jobs.popleft()
+            if jobs:
+                clients[client] = jobs
+            return job
+        return None
+
+    def _next(self):
+        """The next job to run, standard first unless reasoning jobs have waited through a full burst"""
+        with self._lock:
+            if sum(self._running.values()) >= self.workers:
+                return None
+            order = LANES
+            if self._burst >= self.standard_burst:
+                order = tuple(reversed(LANES))
+            for lane in order:
+                job = self._take(lane)
+                if job is not None:
+                    # Only standard jobs dispatched while reasoning jobs wait count towards the burst
+                    self._burst = self._burst + 1 if lane == "standard" and self._lanes["reasoning"] else 0
+                    self._running[job.client] += 1
+                    return job
+            return None
+
+    def _expire(self):
+        """Drop every waiting job that has waited longer than max_wait, runnable or not"""
+        if self.max_wait is None:
+            return
+        expired = []
+        with self._lock:
+            cutoff = time.monotonic() - self.max_wait
+            for clients in self._lanes.values():
+                for client in list(clients):
+                    jobs = clients[client]
+                    while jobs and jobs[0].enqueued < cutoff:
+                        expired.append(jobs.popleft())
+                    if not jobs:
+                        del clients[client]
+            self.stats["expired"] += len(expired)
+        for job in expired:
+            self._shed.inc(reason="expired")
+            if job.on_shed is not None:
+                job.on_shed("expired")
+
+    def _schedule_expiry(self):
+        """Pump again when the oldest waiting job is due to expire, even if nothing else happens by then"""
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        if self.max_wait is None:
+            return
+        with self._lock:
+            oldest = min((jobs[0].enqueued for clients in self._lanes.values() for jobs in clients.values()), default=None)
+        if oldest is not None:
+            delay = max(oldest + self.max_wait - time.monotonic(), 0.0)
+            self._expiry = asyncio.get_running_loop().call_later(delay + 0.01, self._pump)
+
+    def _pump(self):
+        """Drop the jobs that waited too long, start every job that can run now, then update positions"""
+        self._expire()
+        while (job := self._next()) is not None:
+            waited = time.monotonic() - job.enqueued
+            self._waits.observe(waited, lane=job.lane)
+            asyncio.ensure_future(self._run(job))
+        self._announce()
+        self._schedule_expiry()
+
+    async def _run(self, job):
+        outcome = "completed"
+        try:
+            await job.run()
+        except Exception as e:
+            # Printed rather than lost, like any other fire-and-forget coroutine on the loop
+            outcome = "failed"
+            traceback.print_exc()
+            if job.on_error is not None:
+                job.on_error(e)
+        finally:
+            self._finish(job, outcome)
+            self._pump()
+
+    def _finish(self, job, outcome):
+        with self._lock:
+            self._running[job.client] -= 1
+            if not self._running[job.client]:
+                del self._running[job.client]
+            self.stats[outcome] += 1
+
+    def _dispatch_order(self):
+        """Waiting jobs in the order they are expected to start"""
+        order = []
+        with self._lock:
+            for lane in LANES:
+                queues = [list(jobs) for jobs in self._lanes[lane].values()]
+                # Clients take turns, so the i-th job of every client goes before any client's (i+1)-th
+                for index in range(max((len(jobs) for jobs in queues), default=0)):
+                    order.extend(jobs[index] for jobs in queues if index < len(jobs))
+        return order
+
+    def _announce(self):
+        """Tell every waiting job whose place in the queue changed"""
+        for position, job in enumerate(self._dispatch_order(), start=1):
+            if job.position != position:
+                job.position = position
+                if job.on_position is not None:
+                    job.on_position(position)
+
+    def report(self):
+        with self._lock:
+            queued = {lane: sum(len(jobs) for jobs in clients.values()) for lane, clients in self._lanes.items()}
+            return {
+                "workers": self.workers,
+                "running": sum(self._running.values()),
+                "queued": queued,
+                "max_queue": self.max_queue,
+                "client_queue": self.client_queue,
+                "client_running": self.client_running,
+                **self.stats,
+            }
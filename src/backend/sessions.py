@@ -0,0 +1,150 @@
+# sessions.py
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+from backend.chatbot import Chatbot
+
+
+class Session:
+    """A single client's chatbot state"""
+
+    def __init__(self, key, chatbot):
+        self.key = key
+        self.chatbot = chatbot
+        # Serializes turns of this client only; other sessions are never blocked by it
+        self.lock = threading.Lock()
+        self.async_lock = asyncio.Lock()
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+    def touch(self):
+        """Mark the session as recently used"""
+        self.last_used = time.monotonic()
+
+    def busy(self):
+        """Whether a turn is currently running on this session"""
+        return self.lock.locked() or self.async_lock.locked()
+
+    def idle_for(self, now=None):
+        """Seconds since the session was last used"""
+        return (now or time.monotonic()) - self.last_used
+
+
+class SessionManager:
+    """Bounded pool of per-client Chatbot instances with LRU and idle-TTL eviction"""
+
+    def __init__(self, factory=Chatbot, max_sessions=256, idle_ttl=1800):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+
+        # Ordered from least to most recently used
+        self._sessions = OrderedDict()
+        # Guards the pool bookkeeping only, it is never held while a chatbot is working
+        self._lock = threading.Lock()
+        self.evicted = {"lru": 0, "idle": 0}
+
+    def get(self, key):
+        """Return the session for key, creating it if needed"""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = Session(key, self.factory())
+                session.chatbot.session_id = key
+                self._sessions[key] = session
+            else:
+                self._sessions.move_to_end(key)
+            session.touch()
+            self._evict()
+            return session
+
+    def _release(self, session):
+        """Mark a session used at the end of a turn, moving it to the back so the pool stays ordered by last use"""
+        with self._lock:
+            session.touch()
+            if self._sessions.get(session.key) is session:
+                self._sessions.move_to_end(session.key)
+
+    @contextmanager
+    def use(self, key):
+        """Hold a session's lock for one turn and yield its chatbot"""
+        session = self.get(key)
+        with session.lock:
+            yield session.chatbot
+            self._release(session)
+
+    @asynccontextmanager
+    async def use_async(self, key):
+        """Async variant of use() for chatbots driven from an event loop"""
+        session = self.get(key)
+        async with session.async_lock:
+            yield session.chatbot
+            self._release(session)
+
+    def drop(self, key):
+        """Forget a session, e.g. when its client disconnects"""
+        with self._lock:
+            return self._sessions.pop(key, None) is not None
+
+    def evict_idle(self):
+        """Evict sessions idle for longer than the TTL"""
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        """Evict expired sessions, then least recently used ones over capacity"""
+        now = time.monotonic()
+        for key, session in list(self._sessions.items()):
+            # Sessions are ordered by last use, so the first fresh one ends the scan
+            if session.idle_for(now) < self.idle_ttl:
+                break
+            if not session.busy():
+                del self._sessions[key]
+                self.evicted["idle"] += 1
+
+        for key, session in list(self._sessions.items()):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            # Never evict a session that is in the middle of a turn
+            if not session.busy():
+                del self._sessions[key]
+                self.evicted["lru"] += 1
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def busy_count(self):
+        """Number of sessions with a turn in progress"""
+        with self._lock:
+            return sum(session.busy() for session in self._sessions.values())
+
+    def stats(self):
+        """Report per-session and total history sizes"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+
+        now = time.monotonic()
+        per_session = [
+            {
+                "key": session.key,
+                "history_bytes": session.chatbot.history_bytes(),
+                "messages": len(session.chatbot.conversation_history) + len(session.chatbot.reasoning_history),
+                "idle_seconds": round(session.idle_for(now), 1),
+                "last_ttft_ms": None if session.chatbot.last_ttft is None else round(session.chatbot.last_ttft * 1000),
+                "busy": session.busy(),
+                "usage": session.chatbot.session_usage.report(),
+                "last_run": session.chatbot.last_run,
+            }
+            for session in sessions
+        ]
+        return {
+            "active_sessions": len(per_session),
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "evicted": dict(self.evicted),
+            "total_history_bytes": sum(s["history_bytes"] for s in per_session),
+            "sessions": per_session,
+        }
@@ -0,0 +1,51 @@
+# similarity.py
+import re
+from difflib import SequenceMatcher
+
+
+def normalize(text):
+    """Lowercase text and collapse punctuation and whitespace"""
+    return " ".join(re.findall(r"\w+", (text or "").lower()))
+
+
+def char_ngrams(text, n=3):
+    """Set of character n-grams of the normalized text"""
+    text = normalize(text)
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def ngram_similarity(a, b, n=3):
+    """Jaccard overlap of the character n-grams of a and b, between 0 and 1"""
+    grams_a, grams_b = char_ngrams(a, n), char_ngrams(b, n)
+    if not grams_a and not grams_b:
+        return 1.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+# Words of each text the edit distance looks at; difflib is quadratic, so long answers are cut
+EDIT_MAX_WORDS = 500
+
+
+def _edit_words(text):
+    """Normalized words of text, only its opening and closing words when it is long"""
+    words = normalize(text).split()
+    if len(words) <= EDIT_MAX_WORDS:
+        return words
+    half = EDIT_MAX_WORDS // 2
+    return words[:half] + words[-half:]
+
+
+def edit_similarity(a, b):
+    """One minus the normalized word-level edit distance between a and b, as approximated by difflib"""
+    return SequenceMatcher(None, _edit_words(a), _edit_words(b), autojunk=False).ratio()
+
+
+def text_similarity(a, b):
+    """How alike two answers are, between 0 (unrelated) and 1 (same wording)"""
+    # n-gram overlap is cheap and order-insensitive, so only pay for the edit distance when it is close
+    overlap = ngram_similarity(a, b)
+    if overlap < 0.5:
+        return overlap
+    return (overlap + edit_similarity(a, b)) / 2
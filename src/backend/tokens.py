@@ -0,0 +1,25 @@
+# tokens.py
+
+# Tokens every chat message costs on top of its content (role and separators)
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text):
+    """Rough local token count, about four characters per token for English text"""
+    if not text:
+        return 0
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message):
+    """Estimated prompt tokens taken by one chat message"""
+    content = message.get("content")
+    if isinstance(content, list):
+        # Content parts, only the text ones count
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return MESSAGE_OVERHEAD + estimate_tokens(content) + estimate_tokens(message.get("name"))
+
+
+def messages_tokens(messages):
+    """Estimated prompt tokens of a whole request"""
+    return sum(message_tokens(message) for message in messages)
@@ -0,0 +1,160 @@
+# transport.py
+import importlib.util
+import os
+import threading
+from collections import Counter
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+
+
+class SharedTransport:
+    """One keep-alive connection pool for every OpenRouter client in the process
+
+    Clients handed out by openai_client and async_openai_client all send
+    through the same httpx client (one for blocking code, one for asyncio), so
+    sessions reuse warm connections instead of each paying for its own TCP and
+    TLS handshakes. Connection set-up is counted through httpcore's trace
+    hook to report how often requests reuse a connection.
+    """
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0, http2=False):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            print("HTTP2=1 but the h2 package is not installed, using HTTP/1.1")
+
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        # Called with (request, response) for every response, e.g. to read rate-limit headers
+        self.listeners = []
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _trace(self, event, info):
+        """httpcore trace callback: count requests, new connections and TLS handshakes"""
+        if event == "connection.connect_tcp.complete":
+            self._count("connections_opened")
+        elif event == "connection.start_tls.complete":
+            self._count("tls_handshakes")
+        elif event.endswith(".send_request_headers.started"):
+            self._count("requests")
+
+    async def _atrace(self, event, info):
+        self._trace(event, info)
+
+    def _on_request(self, request):
+        request.extensions["trace"] = self._trace
+
+    async def _aon_request(self, request):
+        request.extensions["trace"] = self._atrace
+
+    def _on_response(self, response):
+        for listener in self.listeners:
+            listener(response.request, response)
+
+    async def _aon_response(self, response):
+        self._on_response(response)
+
+    def client(self):
+        """The shared blocking httpx client"""
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(
+                    limits=self.limits,
+                    http2=self.http2,
+                    follow_redirects=True,
+                    event_hooks={"request": [self._on_request], "response": [self._on_response]},
+                )
+            return self._client
+
+    def async_client(self):
+        """The shared asyncio httpx client, to be used from one event loop"""
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = httpx.AsyncClient(
+                    limits=self.limits,
+                    http2=self.http2,
+                    follow_redirects=True,
+                    event_hooks={"request": [self._aon_request], "response": [self._aon_response]},
+                )
+            return self._async_client
+
+    @staticmethod
+    def _pool_state(client):
+        """(open, busy) connections of an httpx client's pool"""
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        return len(connections), sum(1 for connection in connections if not connection.is_idle())
+
+    def report(self):
+        """Pool limits and utilization, and how often requests reused a connection"""
+        with self._lock:
+            stats = dict(self.stats)
+            clients = [client for client in (self._client, self._async_client) if client is not None]
+        open_connections, busy = 0, 0
+        for client in clients:
+            opened, active = self._pool_state(client)
+            open_connections += opened
+            busy += active
+        requests = stats.get("requests", 0)
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "open_connections": open_connections,
+            "busy_connections": busy,
+            "utilization": round(busy / (self.limits.max_connections * max(len(clients), 1)), 3),
+            **stats,
+            "reuse_rate": round(1 - stats.get("connections_opened", 0) / requests, 3) if requests else None,
+        }
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_transport():
+    """The process-wide connection pool, configured from the environment"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SharedTransport(
+                max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 100)),
+                max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", 20)),
+                keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30)),
+                http2=os.getenv("HTTP2", "0") == "1",
+            )
+        return _shared
+
+
+def openai_client():
+    """An OpenRouter client sending through the shared pool; retries are left to the upstream layer"""
+    return OpenAI(
+        base_url=os.getenv("OPENROUTER_BASE_URL", DEFAULT_BASE_URL),
+        api_key=os.getenv("API_KEY"),
+        max_retries=0,
+        http_client=shared_transport().client(),
+    )
+
+
+def async_openai_client():
+    """An asynchronous OpenRouter client sending through the shared pool"""
+    return AsyncOpenAI(
+        base_url=os.getenv("OPENROUTER_BASE_URL", DEFAULT_BASE_URL),
+        api_key=os.getenv("API_KEY"),
+        max_retries=0,
+        http_client=shared_transport().async_client(),
+    )
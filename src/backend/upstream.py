@@ -0,0 +1,342 @@
+# upstream.py
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import openai
+
+from backend.ratelimit import shared_rate_limiter
+
+# Seconds one attempt of each phase may take before it is abandoned
+PHASE_TIMEOUTS = {
+    "get_response": 60,
+    "analyze_input": 60,
+    "execute_reasoning_step": 60,
+    "generate_critical_analysis": 45,
+    "reasoning_response": 60,
+    "summarize_context": 30,
+}
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUSES = {408, 409, 429}
+
+
+def is_retryable(error):
+    """Whether an upstream error is transient, so the same request may succeed when sent again"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUSES or error.status_code >= 500
+    return False
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait before retrying, if it said so"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LatencyWindow:
+    """Recent latencies of one phase and model, for percentiles"""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+
+class Upstream:
+    """Sends upstream requests with per-phase timeouts, retries and hedging
+
+    Retryable errors are retried with full-jitter exponential backoff, or after
+    the server's Retry-After, within the caller's deadline. With hedging on,
+    an attempt still running after the observed p95 latency of its phase and
+    model gets a duplicate, sent to the same or a fallback model; the first
+    successful reply wins.
+    """
+
+    def __init__(self, timeouts=None, default_timeout=60, retries=2, backoff=0.5, backoff_cap=8.0,
+                 hedge=False, hedge_fallbacks=None, hedge_min_delay=1.0, hedge_min_samples=20, hedge_workers=64,
+                 limiter=None):
+        self.timeouts = {**PHASE_TIMEOUTS, **(timeouts or {})}
+        self.default_timeout = default_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_fallbacks = hedge_fallbacks or {}
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_workers = hedge_workers
+        # Every attempt, retries and hedges included, waits for its model's rate limit,
+        # and its outcome tunes that limit
+        self.limiter = limiter
+
+        self._latency = defaultdict(LatencyWindow)
+        self._pool = None
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        # Attempts and failed attempts per model, for the model router
+        self.model_attempts = Counter()
+        self.model_errors = Counter()
+
+    def timeout(self, phase):
+        return self.timeouts.get(phase, self.default_timeout)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _observe(self, phase, model, seconds):
+        with self._lock:
+            self._latency[(phase, model)].add(seconds)
+            self.model_attempts[model] += 1
+
+    def _failed(self, model, error):
+        with self._lock:
+            self.model_attempts[model] += 1
+            self.model_errors[model] += 1
+        if self.limiter is not None:
+            self.limiter.failed(model, error)
+
+    def _succeeded(self, phase, model, seconds, tokens, result):
+        self._observe(phase, model, seconds)
+        if self.limiter is not None:
+            self.limiter.succeeded(model, tokens, result)
+
+    def health(self, phase, model):
+        """(latency samples, p50 seconds or None, error rate) of a model in one phase"""
+        with self._lock:
+            window = self._latency.get((phase, model))
+            samples = len(window.samples) if window is not None else 0
+            attempts = self.model_attempts[model]
+            error_rate = self.model_errors[model] / attempts if attempts else 0.0
+            return samples, window.percentile(0.5) if samples else None, error_rate
+
+    def hedge_delay(self, phase, model):
+        """Seconds to wait before hedging a call, or None when it should not be hedged"""
+        if not self.hedge:
+            return None
+        with self._lock:
+            window = self._latency.get((phase, model))
+            if window is None or len(window.samples) < self.hedge_min_samples:
+                return None
+            return max(window.percentile(0.95), self.hedge_min_delay)
+
+    def _attempt_timeout(self, phase, ends):
+        """Timeout of the next attempt, shortened to what is left before the deadline"""
+        timeout = self.timeout(phase)
+        if ends is not None:
+            timeout = max(min(timeout, ends - time.monotonic()), 1.0)
+        return timeout
+
+    def _retry_delay(self, error, attempt, ends):
+        """Seconds to wait before retrying after error, or None to give up"""
+        if isinstance(error, openai.APITimeoutError):
+            self._count("timeouts")
+        if not is_retryable(error) or attempt >= self.retries:
+            return None
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.backoff_cap, self.backoff * 2 ** attempt))
+        delay = min(delay, self.backoff_cap)
+        if ends is not None and time.monotonic() + delay >= ends:
+            return None
+        return delay
+
+    def call(self, phase, model, send, deadline=None, hedge=True, tokens=0):
+        """Run send(model, timeout) until it succeeds, retrying transient errors; returns (model, reply)
+
+        deadline is the number of seconds the caller can still wait, if limited,
+        and tokens the estimated prompt and completion tokens of one attempt.
+        The returned model is the one that answered, a hedge's fallback included.
+        """
+        self._count("calls")
+        ends = None if deadline is None else time.monotonic() + deadline
+        attempt = 0
+        while True:
+            self._count("attempts")
+            try:
+                return self._attempt(phase, model, send, ends, hedge, tokens)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, ends)
+                if delay is None:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                time.sleep(delay)
+                attempt += 1
+
+    def _max_wait(self, ends):
+        """Longest rate-limit wait the deadline leaves room for"""
+        return None if ends is None else max(ends - time.monotonic(), 0.0)
+
+    def _can_hedge(self, model, tokens):
+        """Whether the rate limit lets a hedge go to model right away; a hedge that has to wait only adds load"""
+        if self.limiter is None or self.limiter.try_acquire(model, tokens):
+            return True
+        self._count("hedges_skipped")
+        return False
+
+    def _timed(self, phase, model, send, timeout, tokens=0):
+        started = time.monotonic()
+        try:
+            result = send(model, timeout)
+        except Exception as e:
+            self._failed(model, e)
+            raise
+        self._succeeded(phase, model, time.monotonic() - started, tokens, result)
+        return result
+
+    def _attempt(self, phase, model, send, ends, hedge, tokens=0):
+        """One attempt, hedged once it runs past the phase's p95 latency"""
+        # The rate-limit wait comes before the attempt's timeout and hedge timer start
+        if self.limiter is not None:
+            self.limiter.acquire(model, tokens, self._max_wait(ends))
+        timeout = self._attempt_timeout(phase, ends)
+        delay = self.hedge_delay(phase, model) if hedge else None
+        if delay is None:
+            return model, self._timed(phase, model, send, timeout, tokens)
+
+        pool = self._hedge_pool()
+        primary = pool.submit(self._timed, phase, model, send, timeout, tokens)
+        done, _ = wait([primary], timeout=delay)
+        fallback = self.hedge_fallbacks.get(model, model)
+        if done or not self._can_hedge(fallback, tokens):
+            return model, primary.result()
+
+        # The loser cannot be interrupted in a thread, it finishes in the background
+        hedged = pool.submit(self._timed, phase, fallback, send, timeout, tokens)
+        self._count("hedged")
+        pending, error = {primary, hedged}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedged:
+                        self._count("hedge_wins")
+                        return fallback, future.result()
+                    return model, future.result()
+                error = future.exception()
+        raise error
+
+    def _hedge_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.hedge_workers, thread_name_prefix="hedge")
+            return self._pool
+
+    async def acall(self, phase, model, send, deadline=None, hedge=True, tokens=0):
+        """Async version of call, send(model, timeout) returning an awaitable"""
+        self._count("calls")
+        ends = None if deadline is None else time.monotonic() + deadline
+        attempt = 0
+        while True:
+            self._count("attempts")
+            try:
+                return await self._aattempt(phase, model, send, ends, hedge, tokens)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, ends)
+                if delay is None:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _atimed(self, phase, model, send, timeout, tokens=0):
+        started = time.monotonic()
+        try:
+            result = await send(model, timeout)
+        except Exception as e:
+            self._failed(model, e)
+            raise
+        self._succeeded(phase, model, time.monotonic() - started, tokens, result)
+        return result
+
+    async def _aattempt(self, phase, model, send, ends, hedge, tokens=0):
+        """One attempt, hedged once it runs past the phase's p95 latency; the loser is cancelled"""
+        if self.limiter is not None:
+            await self.limiter.aacquire(model, tokens, self._max_wait(ends))
+        timeout = self._attempt_timeout(phase, ends)
+        delay = self.hedge_delay(phase, model) if hedge else None
+        if delay is None:
+            return model, await self._atimed(phase, model, send, timeout, tokens)
+
+        primary = asyncio.ensure_future(self._atimed(phase, model, send, timeout, tokens))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        fallback = self.hedge_fallbacks.get(model, model)
+        if done or not self._can_hedge(fallback, tokens):
+            return model, await primary
+
+        hedged = asyncio.ensure_future(self._atimed(phase, fallback, send, timeout, tokens))
+        self._count("hedged")
+        pending, error = {primary, hedged}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            self._count("hedge_wins")
+                            return fallback, task.result()
+                        return model, task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def report(self):
+        """Retry, timeout and hedge counters, and latency percentiles per phase and model"""
+        with self._lock:
+            latency = {
+                f"{phase} {model}": {
+                    "samples": len(window.samples),
+                    "p50_ms": round(window.percentile(0.5) * 1000),
+                    "p95_ms": round(window.percentile(0.95) * 1000),
+                }
+                for (phase, model), window in self._latency.items() if window.samples
+            }
+            return {"retries_allowed": self.retries, "hedge": self.hedge, **self.stats, "latency": latency}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_upstream():
+    """The process-wide upstream request layer, configured from the environment"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Upstream(
+                timeouts=json.loads(os.getenv("UPSTREAM_TIMEOUTS", "{}")),
+                default_timeout=float(os.getenv("UPSTREAM_TIMEOUT", 60)),
+                retries=int(os.getenv("UPSTREAM_RETRIES", 2)),
+                backoff=float(os.getenv("UPSTREAM_BACKOFF", 0.5)),
+                backoff_cap=float(os.getenv("UPSTREAM_BACKOFF_CAP", 8)),
+                hedge=os.getenv("HEDGE", "0") == "1",
+                hedge_fallbacks=json.loads(os.getenv("HEDGE_FALLBACKS", "{}")),
+                hedge_min_delay=float(os.getenv("HEDGE_MIN_DELAY", 1.0)),
+                hedge_min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", 20)),
+                limiter=shared_rate_limiter(),
+            )
+        return _shared
@@ -0,0 +1,166 @@
+# batch.py
+# Runs a JSONL file of prompts through the chatbot, several at a time, and streams the results to a JSONL file.
+#
+#   python src/batch.py prompts.jsonl -o results.jsonl --mode reasoning --concurrency 8 \
+#       --rate-limit openai/gpt-4o=60 --token-limit openai/gpt-4o=30000 --resume
+#
+# Each input line is {"prompt": "...", "id": "...", "mode": "standard|reasoning"}; only "prompt" is required.
+# Like the benchmarks, runs neither use nor feed the fast-path router, the plan index or the ledger file
+# unless asked to, so items are judged independently and production data stays clean.
+from backend.async_chatbot import AsyncChatbot
+from backend.ratelimit import shared_rate_limiter
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+load_dotenv("env/.env")
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run JSONL prompts through the chatbot")
+    parser.add_argument("input", help="JSONL file with one {\"prompt\": ...} object per line")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file results are appended to as they complete")
+    parser.add_argument("--mode", choices=("standard", "reasoning"), default="standard",
+                        help="mode for items that do not set their own")
+    parser.add_argument("--concurrency", type=positive_int, default=8, help="items in flight at once")
+    parser.add_argument("--rate-limit", action="append", default=[], metavar="MODEL=RPM",
+                        help="requests per minute allowed to a model, repeatable")
+    parser.add_argument("--token-limit", action="append", default=[], metavar="MODEL=TPM",
+                        help="prompt and completion tokens per minute allowed to a model, repeatable")
+    parser.add_argument("--offset", type=int, default=0, help="skip the first OFFSET input lines")
+    parser.add_argument("--limit", type=int, default=None, help="stop after LIMIT input lines")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip items whose index is already in the output file")
+    parser.add_argument("--fastpath", action="store_true",
+                        help="let the fast-path router skip the supervisor and learn from this run's plans")
+    parser.add_argument("--plan-reuse", action="store_true",
+                        help="reuse and index supervisor plans across items")
+    parser.add_argument("--ledger", default="", metavar="PATH",
+                        help="append the priced usage of every call to PATH, none by default")
+    return parser.parse_args(argv)
+
+
+def completed_indices(path):
+    """Indices of the items already answered in an output file; failed items are run again"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as results:
+        for line in results:
+            try:
+                result = json.loads(line)
+                if "error" not in result:
+                    done.add(result["index"])
+            except (json.JSONDecodeError, KeyError, TypeError):
+                # A line cut short by a crash is simply run again
+                continue
+    return done
+
+
+def read_items(path, offset=0, limit=None, skip=()):
+    """Yield (index, item) from the input file lazily, so large files are never held in memory"""
+    with open(path, encoding="utf-8") as prompts:
+        for index, line in enumerate(prompts):
+            if index < offset or index in skip or not line.strip():
+                continue
+            if limit is not None and index >= offset + limit:
+                break
+            yield index, json.loads(line)
+
+
+async def run_item(index, item, default_mode):
+    """Answer one item with a fresh chatbot and describe the result"""
+    mode = item.get("mode", default_mode)
+    chatbot = AsyncChatbot()
+    chatbot.reasoning_enabled = mode == "reasoning"
+    result = {"index": index, "id": item.get("id"), "mode": mode, "prompt": item["prompt"]}
+
+    started = time.perf_counter()
+    try:
+        result["response"] = await chatbot.process_input(item["prompt"])
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    else:
+        # Upstream errors are answered with an error reply rather than raised
+        if chatbot.last_error is not None:
+            result["error"] = chatbot.last_error
+            del result["response"]
+    result["seconds"] = round(time.perf_counter() - started, 3)
+
+    usage = chatbot.session_usage.report()
+    result.update({
+        "rounds": usage["rounds"],
+        "stopped_by": chatbot.last_run["stopped_by"] if chatbot.last_run else None,
+        "calls": usage["calls"],
+        "input_tokens": usage["input_tokens"],
+        "output_tokens": usage["output_tokens"],
+        "cached_tokens": usage["cached_tokens"],
+        "cost": usage["cost"],
+    })
+    return result
+
+
+def isolate(args):
+    """Settings that keep the run's items independent and out of the shared data files, unless asked otherwise"""
+    # Read when the first chatbot builds the process-wide instances, so they must be set before
+    os.environ["FASTPATH"] = "1" if args.fastpath else "0"
+    os.environ["PLAN_REUSE"] = "1" if args.plan_reuse else "0"
+    os.environ["LEDGER_PATH"] = args.ledger
+
+
+async def run_batch(args):
+    isolate(args)
+    for rule in args.rate_limit:
+        model, _, per_minute = rule.rpartition("=")
+        shared_rate_limiter().set_limit(model, float(per_minute))
+    for rule in args.token_limit:
+        model, _, per_minute = rule.rpartition("=")
+        shared_rate_limiter().set_token_limit(model, float(per_minute))
+
+    skip = completed_indices(args.output) if args.resume else set()
+    items = read_items(args.input, args.offset, args.limit, skip)
+    # A small queue keeps reading ahead of the workers without loading the whole file
+    queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    counts = {"done": 0, "failed": 0}
+    started = time.perf_counter()
+
+    async def produce():
+        for entry in items:
+            await queue.put(entry)
+        for _ in range(args.concurrency):
+            await queue.put(None)
+
+    async def work(output):
+        while (entry := await queue.get()) is not None:
+            result = await run_item(*entry, args.mode)
+            # Each result is written and flushed as soon as it is known, so a crash loses nothing finished
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            counts["done"] += 1
+            counts["failed"] += "error" in result
+            if counts["done"] % 10 == 0:
+                rate = counts["done"] / (time.perf_counter() - started)
+                print(f"{counts['done']} done, {counts['failed']} failed, {rate:.2f} items/s", file=sys.stderr)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "a", encoding="utf-8") as output:
+        await asyncio.gather(produce(), *(work(output) for _ in range(args.concurrency)))
+
+    print(f"Finished: {counts['done']} items, {counts['failed']} failed, {len(skip)} skipped as already done, "
+          f"{time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return counts
+
+
+if __name__ == "__main__":
+    asyncio.run(run_batch(parse_args()))
@@ -3,6 +3,7 @@ const messageContainer = document.getElementById('messageContainer');
 const userInput = document.getElementById('userInput');
 const sendButton = document.getElementById('sendButton');
 const reasoningToggle = document.getElementById('reasoningToggle');
+const answerFirstToggle = document.getElementById('answerFirstToggle');
 
 let isReasoningMode = false;
 
@@ -50,6 +51,18 @@ reasoningToggle.addEventListener('change', () => {
     socket.emit('toggle_reasoning');
 });
 
+answerFirstToggle.addEventListener('change', () => {
+    socket.emit('toggle_answer_first');
+});
+
+socket.on('answer_first_toggled', (data) => {
+    const feedback = document.createElement('div');
+    feedback.classList.add('message', 'bot-message', 'mode-change-message');
+    feedback.textContent = `Answer first ${data.enabled ? 'enabled' : 'disabled'}`;
+    messageContainer.appendChild(feedback);
+    setTimeout(() => feedback.remove(), 3000);
+});
+
 socket.on('reasoning_toggled', (data) => {
     isReasoningMode = data.enabled;
     // Visual feedback when mode changes
@@ -73,11 +86,126 @@ socket.on('receive_message', (data) => {
     addMessage(data.message, 'bot');
 });
 
+// Reasoning progress is shown as a live log until the final answer arrives
+function describeProgress(data) {
+    switch (data.event) {
+        case 'plan_ready':
+            return `Plan ready: ${data.steps.length} steps (${data.complexity})`;
+        case 'step_started':
+            return `Step ${data.index}/${data.total}: ${data.step}`;
+        case 'step_finished':
+            return `Step ${data.index}/${data.total} done`;
+        case 'critique':
+            return `Review ${data.round}: satisfaction ${data.satisfaction}, accuracy ${data.accuracy}`;
+        case 'refinement':
+            return `Refinement ${data.round} done`;
+        default:
+            return null;
+    }
+}
+
+socket.on('reasoning_progress', (data) => {
+    let progress = document.querySelector('.reasoning-progress');
+    if (data.event === 'done') {
+        if (progress) progress.remove();
+        return;
+    }
+    const text = describeProgress(data);
+    if (!text) return;
+
+    if (!progress) {
+        progress = document.createElement('div');
+        progress.classList.add('message', 'bot-message', 'reasoning-progress');
+        messageContainer.appendChild(progress);
+    }
+    const line = document.createElement('div');
+    line.textContent = text;
+    progress.appendChild(line);
+    messageContainer.scrollTop = messageContainer.scrollHeight;
+});
+
+// In answer-first mode the draft may later be followed by a refined answer
+socket.on('receive_revision', (data) => {
+    const pending = document.querySelector('.refining-note');
+    if (pending) pending.remove();
+    if (!data.revised) return;
+
+    const messageDiv = document.createElement('div');
+    messageDiv.classList.add('message', 'bot-message', 'revision-message');
+    messageDiv.textContent = data.message;
+    messageContainer.appendChild(messageDiv);
+    messageContainer.scrollTop = messageContainer.scrollHeight;
+});
+
+// While a turn waits for the server its place in the queue is shown; position 0 means it has started
+socket.on('queue_position', (data) => {
+    let note = document.querySelector('.queue-note');
+    if (data.position === 0) {
+        if (note) note.remove();
+        return;
+    }
+    if (!note) {
+        note = document.createElement('div');
+        note.classList.add('message', 'bot-message', 'reasoning-progress', 'queue-note');
+        messageContainer.appendChild(note);
+    }
+    note.textContent = `Waiting for the server: ${data.position} ahead of you`;
+    messageContainer.scrollTop = messageContainer.scrollHeight;
+});
+
+socket.on('busy', (data) => {
+    const note = document.querySelector('.queue-note');
+    if (note) note.remove();
+    addMessage(data.message, 'bot');
+});
+
+// Streamed replies grow a single bot message as tokens arrive
+let streamingMessage = null;
+
+// A turn that failed on the server ends like any other, with the error as its reply
+socket.on('turn_error', (data) => {
+    document.querySelectorAll('.queue-note, .typing-indicator').forEach((note) => note.remove());
+    streamingMessage = null;
+    addMessage(data.message, 'bot');
+});
+
+socket.on('receive_token', (data) => {
+    if (!streamingMessage) {
+        const typingIndicator = document.querySelector('.typing-indicator');
+        if (typingIndicator) typingIndicator.remove();
+
+        streamingMessage = document.createElement('div');
+        streamingMessage.classList.add('message', 'bot-message');
+        messageContainer.appendChild(streamingMessage);
+    }
+    streamingMessage.textContent += data.token;
+    messageContainer.scrollTop = messageContainer.scrollHeight;
+});
+
+socket.on('receive_message_done', (data) => {
+    if (streamingMessage) {
+        streamingMessage.textContent = data.message;
+        streamingMessage = null;
+    } else {
+        const typingIndicator = document.querySelector('.typing-indicator');
+        if (typingIndicator) typingIndicator.remove();
+        addMessage(data.message, 'bot');
+    }
+    if (data.refining) {
+        const note = document.createElement('div');
+        note.classList.add('message', 'bot-message', 'reasoning-progress', 'refining-note');
+        note.textContent = 'Double-checking this answer...';
+        messageContainer.appendChild(note);
+        messageContainer.scrollTop = messageContainer.scrollHeight;
+    }
+});
+
 // Add loading state handling
 function setLoadingState(loading) {
     sendButton.disabled = loading;
     userInput.disabled = loading;
     reasoningToggle.disabled = loading;
+    answerFirstToggle.disabled = loading;
     
     if (loading) {
         sendButton.classList.add('loading');
@@ -98,10 +226,18 @@ function sendMessage() {
         setLoadingState(true);
         
         // Remove typing indicator after response is received
-        socket.once('receive_message', () => {
+        const finishTurn = () => {
+            socket.off('receive_message', finishTurn);
+            socket.off('receive_message_done', finishTurn);
+            socket.off('busy', finishTurn);
+            socket.off('turn_error', finishTurn);
             typingIndicator.remove();
             setLoadingState(false);
-        });
+        };
+        socket.on('receive_message', finishTurn);
+        socket.on('receive_message_done', finishTurn);
+        socket.on('busy', finishTurn);
+        socket.on('turn_error', finishTurn);
     }
 }
 
@@ -0,0 +1,82 @@
+# bench_critique_tokens.py
+# Compares supervisor input tokens per critique round with full and delta critiques, offline.
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("API_KEY", "offline")
+for name, value in {"FASTPATH": "0", "PLAN_REUSE": "0", "LEDGER_PATH": "", "CONTEXT_STRATEGY": "off",
+                    "CONVERGENCE": "0", "REQUEST_MAX_ROUNDS": "100"}.items():
+    os.environ[name] = value
+
+from openai.types.chat import ChatCompletion
+from openai.types.chat.parsed_chat_completion import ParsedChatCompletion
+
+from backend.chatbot import Chatbot
+from backend.tokens import messages_tokens
+
+ROUNDS = 6
+ANSWER = "Comparing 9.11 and 9.9 digit by digit: both share the integer part 9, so the tenths decide. " * 6
+
+
+class ScriptedClient:
+    """Stands in for the OpenRouter client: fixed-length answers and 'medium' ratings until the last round"""
+
+    def __init__(self):
+        self.critiques = 0
+        self.critique_tokens = []
+        completions = SimpleNamespace(create=self.create, parse=self.create)
+        self.chat = SimpleNamespace(completions=completions)
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    def create(self, model, messages, response_format=None, **params):
+        content = ANSWER
+        if response_format is not None and response_format.__name__ == "SupervisorJSON":
+            content = json.dumps({
+                "is_question": "true", "complexity": "medium", "reasoning_type": "logical",
+                "perspectives": ["decimal", "versioning"], "dependencies": [[], [1], [2]],
+                "steps": ["Compare the integer parts", "Compare the decimal parts", "State which is greater"],
+                "explanation": "The user compares two decimals; pad them to the same length first.",
+            })
+        elif response_format is not None:
+            self.critiques += 1
+            self.critique_tokens.append(messages_tokens(messages))
+            rating = "high" if self.critiques >= ROUNDS else "medium"
+            content = json.dumps({"satisfaction": rating, "accuracy": rating,
+                                  "instructions": "Show the padded comparison explicitly. " * 8, "failure": False})
+
+        data = {"id": "bench", "object": "chat.completion", "created": 0, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}]}
+        if response_format is None:
+            return ChatCompletion.model_validate(data)
+        data["choices"][0]["message"]["parsed"] = json.loads(content)
+        return ParsedChatCompletion[response_format].model_validate(data)
+
+
+def run(mode, earlier_turns):
+    bot = Chatbot()
+    bot.client = ScriptedClient()
+    bot.critique_mode = mode
+    bot.reasoning_enabled = True
+    # An earlier conversation makes the difference visible on a realistic session
+    for turn in range(earlier_turns):
+        bot.add_message_assistant("user", f"Earlier question {turn}")
+        bot.add_message_assistant("assistant", ANSWER)
+    bot.process_input("which one is greater, 9.11 or 9.9?")
+    return bot.client.critique_tokens
+
+
+def test_critique_tokens():
+    for earlier_turns in (0, 10):
+        full, delta = run("full", earlier_turns), run("delta", earlier_turns)
+        print(f"\n{earlier_turns} earlier turns, {ROUNDS} critique rounds (supervisor input tokens)")
+        print("round   full  delta")
+        for index, (before, after) in enumerate(zip(full, delta), 1):
+            print(f"{index:>5} {before:>6} {after:>6}")
+        print(f"total {sum(full):>6} {sum(delta):>6}  ({100 - 100 * sum(delta) // sum(full)}% fewer)")
+
+
+if __name__ == "__main__":
+    test_critique_tokens()
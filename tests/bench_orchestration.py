@@ -0,0 +1,122 @@
+# bench_orchestration.py
+# Orchestration overhead, throughput and p50/p99 latency of get_response and multi_agent_response, offline.
+#
+#   python tests/bench_orchestration.py --requests 64 --concurrency 1,8,32 --latency 0.2 --ratings medium,medium,high
+#
+# Runs against the local mock server in tests/mock_openrouter.py, or any server given with --base-url.
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+os.environ.setdefault("API_KEY", "offline")
+for name, value in {"FASTPATH": "0", "PLAN_REUSE": "0", "LEDGER_PATH": "", "CACHE_PHASES": ""}.items():
+    os.environ[name] = value
+
+from mock_openrouter import MockOpenRouter
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def overhead(mock, requests):
+    """Milliseconds the chatbot adds on top of a bare client call to an instant server"""
+    from backend.chatbot import Chatbot
+    from backend.transport import openai_client
+
+    latency, mock.latency = mock.latency, 0.0
+    client = openai_client()
+    messages = [{"role": "user", "content": "What is 2 + 2?"}]
+    client.chat.completions.create(model="openai/gpt-3.5-turbo", messages=messages)
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.chat.completions.create(model="openai/gpt-3.5-turbo", messages=messages)
+    raw = (time.perf_counter() - started) / requests
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        Chatbot().get_response("What is 2 + 2?")
+    direct = (time.perf_counter() - started) / requests
+
+    calls_before = mock.requests
+    started = time.perf_counter()
+    for _ in range(max(requests // 4, 1)):
+        Chatbot().multi_agent_response("Why is the sky blue?")
+    runs = max(requests // 4, 1)
+    reasoning = (time.perf_counter() - started) / runs
+    calls = (mock.requests - calls_before) / runs
+    mock.latency = latency
+
+    print(f"Overhead against an instant server ({requests} requests)")
+    print(f"  bare client call          {raw * 1000:8.2f} ms")
+    print(f"  get_response              {direct * 1000:8.2f} ms   (+{(direct - raw) * 1000:.2f} ms)")
+    print(f"  multi_agent_response      {reasoning * 1000:8.2f} ms   ({calls:.0f} upstream calls, "
+          f"+{(reasoning - raw * calls) / calls * 1000:.2f} ms per call)")
+    print()
+
+
+async def load(mode, requests, concurrency):
+    """Run requests fresh chatbots in one mode, concurrency at a time; returns (seconds, latencies)"""
+    from backend.async_chatbot import AsyncChatbot
+
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(index):
+        async with limit:
+            chatbot = AsyncChatbot()
+            started = time.perf_counter()
+            if mode == "reasoning":
+                await chatbot.multi_agent_response(f"Why is the sky blue? ({index})")
+            else:
+                await chatbot.get_response(f"What is {index} + {index}?")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    return time.perf_counter() - started, latencies
+
+
+async def load_table(args):
+    print(f"Load: {args.requests} requests per row, server latency {args.latency}s")
+    print(f"{'mode':<10} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in args.modes.split(","):
+        for concurrency in [int(value) for value in args.concurrency.split(",")]:
+            seconds, latencies = await load(mode, args.requests, concurrency)
+            print(f"{mode:<10} {concurrency:>5} {len(latencies) / seconds:8.1f} "
+                  f"{percentile(latencies, 0.5) * 1000:8.0f} {percentile(latencies, 0.99) * 1000:8.0f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline orchestration benchmarks")
+    parser.add_argument("--requests", type=int, default=64, help="requests per measurement")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--modes", default="standard,reasoning", help="comma-separated: standard, reasoning")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock server seconds per reply")
+    parser.add_argument("--jitter", type=float, default=0.05, help="mock server latency jitter")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="mock generation speed, 0 for instant")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="mock share of 503 replies")
+    parser.add_argument("--ratings", default="medium,medium,high", help="mock critique rating per review round")
+    parser.add_argument("--base-url", default=None, help="benchmark an already running server instead of the mock")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    mock = MockOpenRouter(
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        ratings=args.ratings.split(","),
+    )
+    os.environ["OPENROUTER_BASE_URL"] = args.base_url or mock.start()
+    if args.base_url is None:
+        overhead(mock, args.requests)
+    asyncio.run(load_table(args))
@@ -0,0 +1,50 @@
+# bench_transcript.py
+# Compares rebuilding the Server transcript on every supervisor call with the incremental History.
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from backend.history import History
+
+
+def rebuild(history):
+    """How analyze_input and generate_critical_analysis used to render the transcript"""
+    return '\n'.join(f'{msg["role"]}: "{msg["content"]}"' for msg in history[1:])
+
+
+def run(turns, builder, history):
+    """Append `turns` user/assistant pairs, rendering the transcript after each, and time it"""
+    history.append({"role": "system", "content": "system prompt " * 50})
+    started = time.perf_counter()
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"Question {turn}: " + "why is the sky blue? " * 5})
+        history.append({"role": "assistant", "content": f"Answer {turn}: " + "because of Rayleigh scattering. " * 20})
+        builder(history)
+    return time.perf_counter() - started
+
+
+def test_transcript_rendering():
+    for turns in (100, 500, 1000):
+        before = run(turns, rebuild, [])
+        after = run(turns, History.transcript, History())
+        print(f"{turns:>5} turns: rebuild {before * 1000:8.1f} ms | incremental {after * 1000:8.1f} ms | {before / after:5.1f}x")
+
+    # Appending alone is O(new message): its cost does not grow with the history
+    for turns in (100, 1000):
+        history = History()
+        run(turns, lambda history: None, history)
+        started = time.perf_counter()
+        for _ in range(1000):
+            history.append({"role": "user", "content": "why is the sky blue? " * 5})
+        print(f"{turns:>5} turns: {(time.perf_counter() - started) * 1000:.2f} us per append")
+
+    history = History()
+    run(1000, History.transcript, history)
+    assert history.transcript() == rebuild(history)
+    print(f"1000-turn history holds ~{history.total_tokens} tokens across {len(history.token_counts)} messages")
+
+
+if __name__ == "__main__":
+    test_transcript_rendering()
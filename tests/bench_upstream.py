@@ -0,0 +1,74 @@
+# bench_upstream.py
+# Tail latency and error rate of simulated upstream calls with and without retries, timeouts and hedging, offline.
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import httpx
+import openai
+
+from backend.upstream import Upstream
+
+CALLS = 400
+CONCURRENCY = 16
+FAST = 0.04      # seconds of a normal reply
+STALL = 1.5      # seconds of a stalled reply
+STALL_RATE = 0.03
+ERROR_RATE = 0.02
+REQUEST = httpx.Request("POST", "https://openrouter.ai/api/v1/chat/completions")
+
+
+def simulated_send(rng):
+    """A stand-in for one OpenRouter call: mostly fast, sometimes stalled, sometimes a 503"""
+    def send(model, timeout):
+        roll = rng.random()
+        if roll < ERROR_RATE:
+            time.sleep(FAST / 2)
+            raise openai.InternalServerError("Service Unavailable", response=httpx.Response(503, request=REQUEST), body=None)
+        latency = STALL if roll < ERROR_RATE + STALL_RATE else FAST * rng.uniform(0.8, 1.5)
+        if latency > timeout:
+            time.sleep(timeout)
+            raise openai.APITimeoutError(request=REQUEST)
+        time.sleep(latency)
+        return model
+    return send
+
+
+def run(name, upstream):
+    rng = random.Random(42)
+    send = simulated_send(rng)
+    # Warm the latency window so hedging has a p95 to work with
+    for _ in range(upstream.hedge_min_samples):
+        try:
+            upstream._timed("bench", "model", lambda model, timeout: time.sleep(FAST) or model, 60)
+        except Exception:
+            pass
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            upstream.call("bench", "model", send)
+            return time.perf_counter() - started, None
+        except Exception as e:
+            return time.perf_counter() - started, type(e).__name__
+
+    with ThreadPoolExecutor(CONCURRENCY) as pool:
+        results = list(pool.map(one, range(CALLS)))
+    latencies = sorted(seconds for seconds, _ in results)
+    errors = sum(1 for _, error in results if error)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"{name:<26} {pick(0.5):7.0f} {pick(0.95):7.0f} {pick(0.99):7.0f} {latencies[-1] * 1000:7.0f} {errors:7d}"
+          f"   retries={upstream.stats['retries']} hedged={upstream.stats['hedged']}")
+
+
+if __name__ == "__main__":
+    print(f"{CALLS} calls, {CONCURRENCY} at a time, {STALL_RATE:.0%} stalled for {STALL}s, {ERROR_RATE:.0%} failing with 503")
+    print(f"{'':<26} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'max ms':>7} {'errors':>7}")
+    run("bare", Upstream(retries=0, hedge_min_samples=0))
+    run("retries", Upstream(retries=2, backoff=0.05, hedge_min_samples=0))
+    run("retries + timeout 0.3s", Upstream(timeouts={"bench": 0.3}, retries=2, backoff=0.05, hedge_min_samples=0))
+    run("retries + hedging", Upstream(retries=2, backoff=0.05, hedge=True, hedge_min_delay=0.05, hedge_min_samples=20))
@@ -0,0 +1,302 @@
+# mock_openrouter.py
+# A local stand-in for the OpenRouter chat completions API, for offline benchmarks and debugging.
+#
+#   python tests/mock_openrouter.py --port 8765 --latency 0.3 --tokens-per-second 80 --ratings medium,medium,high
+#   OPENROUTER_BASE_URL=http://127.0.0.1:8765/api/v1 python src/app.py
+#
+# It answers plain completions, structured outputs (SupervisorJSON plans and SupervisorRater critiques, or any
+# other JSON schema) and streamed completions, with configurable latency, generation speed, error rate and
+# requests-per-minute limit.
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("the answer follows from comparing each part in turn and checking the assumptions behind every step "
+         "so the result holds when the edge cases are considered as well").split()
+
+PLAN = {
+    "is_question": "true",
+    "complexity": "medium",
+    "reasoning_type": "analytical",
+    "perspectives": ["definitions", "edge cases"],
+    "steps": ["Restate the question precisely", "Work out the answer", "Check the answer against edge cases"],
+    "dependencies": [[], [1], [2]],
+    "explanation": "The user asks a factual question that is answered by reasoning through it step by step.",
+}
+
+
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def message_text(message):
+    """Text of a message whose content is a string or a list of content blocks"""
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content)
+
+
+def example_for(schema, definitions=None):
+    """A value matching a JSON schema, for structured outputs the mock has no template for"""
+    definitions = definitions or schema.get("$defs", {})
+    if "$ref" in schema:
+        return example_for(definitions[schema["$ref"].split("/")[-1]], definitions)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: example_for(field, definitions) for name, field in schema.get("properties", {}).items()}
+    if kind == "array":
+        return []
+    if kind == "boolean":
+        return False
+    if kind in ("integer", "number"):
+        return 0
+    return "mock"
+
+
+class MockOpenRouter:
+    """OpenAI-compatible chat completions server with scripted, configurable behaviour"""
+
+    def __init__(self, latency=0.2, jitter=0.0, tokens_per_second=0.0, error_rate=0.0,
+                 ratings=("medium", "high"), answer_tokens=60, cache_min_tokens=1024, rate_limit=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        # 0 generates instantly, otherwise the reply takes answer_tokens / tokens_per_second longer
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.ratings = list(ratings)
+        self.answer_tokens = answer_tokens
+        # Prompt prefixes at least this long are cached, like OpenAI's automatic prompt caching
+        self.cache_min_tokens = cache_min_tokens
+        self._prefixes = set()
+        # Requests per minute per model, over a sliding window; 0 for no limit
+        self.rate_limit = rate_limit
+        self._sent = {}
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.server = None
+
+    def _roll(self):
+        with self._lock:
+            self.requests += 1
+            return self.random.random(), self.random.uniform(-self.jitter, self.jitter)
+
+    def rate_limit_headers(self, model):
+        """x-ratelimit headers of a request to model, and whether it is over the limit"""
+        if not self.rate_limit:
+            return {}, False
+        now = time.monotonic()
+        with self._lock:
+            sent = self._sent.setdefault(model, deque())
+            while sent and sent[0] <= now - 60:
+                sent.popleft()
+            limited = len(sent) >= self.rate_limit
+            if not limited:
+                sent.append(now)
+            reset = sent[0] + 60 - now
+        headers = {
+            "x-ratelimit-limit-requests": str(self.rate_limit),
+            "x-ratelimit-remaining-requests": str(self.rate_limit - len(sent)),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        }
+        if limited:
+            headers["retry-after"] = f"{reset:.3f}"
+        return headers, limited
+
+    def cached_tokens(self, model, messages):
+        """Tokens of the longest message prefix an earlier request already sent, once it is long enough"""
+        digest = hashlib.md5(model.encode("utf-8"))
+        tokens, cached, seen = 0, 0, []
+        for message in messages:
+            digest.update(json.dumps([message.get("role"), message_text(message)]).encode("utf-8"))
+            tokens += estimate_tokens(message_text(message)) + 4
+            key = digest.hexdigest()
+            seen.append(key)
+            with self._lock:
+                if key in self._prefixes and tokens >= self.cache_min_tokens:
+                    cached = tokens
+        with self._lock:
+            self._prefixes.update(seen)
+        return cached
+
+    def _answer(self):
+        """Varied prose, so answers never look converged by accident"""
+        with self._lock:
+            words = [self.random.choice(WORDS) for _ in range(self.answer_tokens)]
+        return " ".join(words).capitalize() + "."
+
+    def _round(self, messages):
+        """Review round asked for by a critique prompt"""
+        prompt = message_text(messages[-1])
+        match = re.search(r"review round (\d+)", prompt)
+        if match:
+            return int(match.group(1))
+        # Full-chat critiques carry one "### Reasoning Step" header per earlier round
+        return prompt.count("### Reasoning Step") + 1
+
+    def content_for(self, body):
+        """Reply text for a request, JSON when a structured output is asked for"""
+        messages = body.get("messages", [])
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") != "json_schema":
+            return self._answer()
+
+        spec = response_format["json_schema"]
+        if spec["name"] == "SupervisorJSON":
+            return json.dumps(PLAN)
+        if spec["name"] == "SupervisorRater":
+            index = min(self._round(messages), len(self.ratings)) - 1
+            rating = self.ratings[index] if self.ratings else "high"
+            return json.dumps({
+                "satisfaction": rating,
+                "accuracy": rating,
+                "instructions": "State the assumptions explicitly and check the result against an edge case.",
+                "failure": False,
+            })
+        return json.dumps(example_for(spec.get("schema", {})))
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serve in a daemon thread; returns the base URL to give the OpenAI client"""
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="mock-openrouter", daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}/api/v1"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out as separate writes; without this each reply waits on a delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    return self._json(404, {"error": {"message": "not found", "code": 404}})
+
+                roll, jitter = mock._roll()
+                time.sleep(max(mock.latency + jitter, 0))
+                if roll < mock.error_rate:
+                    return self._json(503, {"error": {"message": "mock upstream unavailable", "code": 503}})
+                model = body.get("model", "mock")
+                headers, limited = mock.rate_limit_headers(model)
+                if limited:
+                    return self._json(429, {"error": {"message": "mock rate limit exceeded", "code": 429}}, headers)
+
+                content = mock.content_for(body)
+                messages = body.get("messages", [])
+                usage = {
+                    "prompt_tokens": sum(estimate_tokens(message_text(m)) + 4 for m in messages),
+                    "completion_tokens": estimate_tokens(content),
+                    "prompt_tokens_details": {"cached_tokens": mock.cached_tokens(model, messages)},
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                if body.get("stream"):
+                    return self._stream(model, content, usage, body, headers)
+
+                if mock.tokens_per_second:
+                    time.sleep(usage["completion_tokens"] / mock.tokens_per_second)
+                self._json(200, {
+                    "id": f"mock-{mock.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": usage,
+                }, headers)
+
+            def _stream(self, model, content, usage, body, headers):
+                """Server-sent events, one word per chunk, paced at tokens_per_second"""
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+
+                def event(choices, **extra):
+                    chunk = {"id": f"mock-{mock.requests}", "object": "chat.completion.chunk",
+                             "created": int(time.time()), "model": model, "choices": choices, **extra}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                words = content.split(" ")
+                pause = 0.0
+                if mock.tokens_per_second:
+                    pause = usage["completion_tokens"] / mock.tokens_per_second / len(words)
+                for i, word in enumerate(words):
+                    event([{"index": 0, "delta": {"content": (" " if i else "") + word}, "finish_reason": None}])
+                    time.sleep(pause)
+                event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    event([], usage=usage)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in for OpenRouter")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before every reply")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- seconds added to the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="generation speed, 0 for instant")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 503")
+    parser.add_argument("--ratings", default="medium,high", help="critique rating of each review round")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="words per plain answer")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024, help="shortest prompt prefix that is cached")
+    parser.add_argument("--rate-limit", type=int, default=0, help="requests per minute per model before 429s, 0 for none")
+    return parser.parse_args(argv)
+
+
+def mock_from_args(args):
+    return MockOpenRouter(
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        ratings=[rating.strip() for rating in args.ratings.split(",") if rating.strip()],
+        answer_tokens=args.answer_tokens,
+        cache_min_tokens=args.cache_min_tokens,
+        rate_limit=args.rate_limit,
+    )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    url = mock_from_args(args).start(args.host, args.port)
+    print(f"Mock OpenRouter listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass